@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'Bandas de Comisiones - Sistema de Prelación',
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.1.0',
     'category': 'Sales/Commission',
     'summary': 'Advanced commission calculation based on payment collection time bands',
     'description': """
@@ -61,6 +61,9 @@ Componentes Principales:
         'views/commission_payment_document_views.xml',
         'views/commission_calculation_batch_views.xml',
         'views/res_users_views.xml',
+        'views/res_company_views.xml',
+        'views/commission_job_views.xml',
+        'views/commission_stat_daily_views.xml',
         'views/commission_band_menu.xml',
         
         # Wizards (después de las vistas que heredan)
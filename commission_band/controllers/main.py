@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
-from odoo import http
+from odoo import http, fields
 from odoo.http import request, content_disposition
 from odoo.exceptions import AccessError
+import hashlib
 import io
+import json
 import xlsxwriter
 from datetime import datetime
 
@@ -244,4 +246,48 @@ class CommissionBandController(http.Controller):
                 ('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
                 ('Content-Disposition', content_disposition(filename))
             ]
-        )
\ No newline at end of file
+        )
+
+    @http.route('/commission_band/dashboard', type='http', auth='user', methods=['GET'])
+    def commission_dashboard(self, company_id=None, team_id=None, date_from=None, date_to=None, **kwargs):
+        """Aggregated commission data of a company or sales team, as JSON
+        
+        Responses carry an ETag derived from the version of the daily
+        statistics, so clients revalidating an unchanged dashboard get a
+        304 without anything being recomputed.
+        """
+        try:
+            company_id = int(company_id) if company_id else request.env.company.id
+            if company_id not in request.env.user.company_ids.ids:
+                return request.not_found()
+            Stat = request.env['commission.stat.daily'].with_company(company_id)
+            Stat.check_access('read')
+            company = Stat.env.company
+            team = Stat.env['crm.team'].browse(int(team_id)) if team_id else None
+            if team:
+                team.check_access('read')
+            date_from = fields.Date.to_date(date_from) if date_from else None
+            date_to = fields.Date.to_date(date_to) if date_to else None
+            domain = Stat._get_dashboard_domain(company, team, date_from, date_to)
+            version = Stat._get_dashboard_stamp(company, team)
+        except (AccessError, ValueError):
+            return request.not_found()
+        
+        etag = hashlib.sha1(json.dumps([
+            request.env.uid, request.env.lang, domain, version,
+        ], default=str).encode()).hexdigest()
+        headers = [
+            ('ETag', '"%s"' % etag),
+            ('Cache-Control', 'private, no-cache'),
+        ]
+        if request.httprequest.if_none_match.contains(etag):
+            return request.make_response('', headers=headers, status=304)
+        
+        data = Stat._get_dashboard_data(domain)
+        data.update({
+            'company': {'id': company.id, 'name': company.name, 'currency': company.currency_id.name},
+            'team': {'id': team.id, 'name': team.name} if team else None,
+            'date_from': fields.Date.to_string(date_from),
+            'date_to': fields.Date.to_string(date_to),
+        })
+        return request.make_json_response(data, headers=headers)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo.tools import sql
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Drop the Many2many relation table replaced by
+    commission_calculation.payment_line_id, once pre-migrate copied it"""
+    if not version or not sql.table_exists(cr, 'commission_payment_line_calc_rel'):
+        return
+
+    # Keep the table while a calculation of it has no payment line, so no
+    # link is lost if the copy did not happen
+    cr.execute("""
+        SELECT 1
+          FROM commission_payment_line_calc_rel r
+          JOIN commission_calculation c ON c.id = r.calc_id
+         WHERE c.payment_line_id IS NULL
+         LIMIT 1
+    """)
+    if cr.rowcount:
+        _logger.warning("Some calculations have no payment line yet, "
+                        "keeping table commission_payment_line_calc_rel")
+        return
+    cr.execute("DROP TABLE commission_payment_line_calc_rel")
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tools import sql
+
+
+def migrate(cr, version):
+    """Move the payment line of calculations from the Many2many relation table
+    to commission_calculation.payment_line_id. post-migrate drops the table"""
+    if not version or not sql.table_exists(cr, 'commission_payment_line_calc_rel'):
+        return
+
+    if not sql.column_exists(cr, 'commission_calculation', 'payment_line_id'):
+        sql.create_column(cr, 'commission_calculation', 'payment_line_id', 'int4')
+
+    # A calculation is paid by one line; keep the latest if there are several
+    cr.execute("""
+        UPDATE commission_calculation c
+           SET payment_line_id = r.line_id
+          FROM (SELECT DISTINCT ON (calc_id) calc_id, line_id
+                  FROM commission_payment_line_calc_rel
+              ORDER BY calc_id, line_id DESC) r
+         WHERE c.id = r.calc_id
+    """)
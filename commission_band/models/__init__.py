@@ -5,8 +5,13 @@ from . import commission_range
 from . import commission_rule
 from . import salesperson_config
 from . import commission_calculation
+from . import commission_stat_daily
+from . import res_company
+from . import res_currency
 from . import res_users
 from . import account_payment
 from . import account_move
+from . import account_partial_reconcile
+from . import commission_job
 from . import commission_batch
 from . import commission_payment_document
\ No newline at end of file
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api, _
+from odoo.tools import SQL
 
 
 class AccountMove(models.Model):
@@ -53,22 +54,31 @@ class AccountMove(models.Model):
     @api.depends('commission_calculation_ids', 'commission_calculation_ids.state', 
                  'commission_calculation_ids.commission_amount', 'commission_calculation_ids.days_overdue')
     def _compute_commission_stats(self):
+        # One grouped query for the whole recordset, so commission columns
+        # stay cheap in invoice list views
+        stats = {}
+        move_ids = self._origin.ids
+        if move_ids:
+            Calculation = self.env['commission.calculation'].sudo()
+            query = Calculation._search([
+                ('invoice_id', 'in', move_ids),
+                ('state', 'not in', ['cancelled'])
+            ])
+            invoice = Calculation._field_to_sql(query.table, 'invoice_id', query)
+            days_overdue = Calculation._field_to_sql(query.table, 'days_overdue', query)
+            query.groupby = invoice
+            stats = {row[0]: row[1:] for row in self.env.execute_query(query.select(
+                invoice,
+                SQL("COUNT(*)"),
+                SQL("COALESCE(SUM(%s), 0)", Calculation._field_to_sql(query.table, 'commission_amount_company', query)),
+                SQL("COALESCE(AVG(%s) FILTER (WHERE %s != 0), 0)", days_overdue, days_overdue),
+            ))}
+        
         for move in self:
-            valid_calculations = move.commission_calculation_ids.filtered(
-                lambda c: c.state not in ['cancelled']
-            )
-            
-            move.commission_calculation_count = len(valid_calculations)
-            
-            # Calculate total commission in company currency
-            total = 0.0
-            for calc in valid_calculations:
-                total += calc.commission_amount_company
+            count, total, avg_days = stats.get(move._origin.id, (0, 0.0, 0.0))
+            move.commission_calculation_count = count
             move.total_commission_amount = total
-            
-            # Calculate average collection days
-            days_list = valid_calculations.filtered('days_overdue').mapped('days_overdue')
-            move.avg_collection_days = sum(days_list) / len(days_list) if days_list else 0.0
+            move.avg_collection_days = avg_days
 
     @api.onchange('invoice_date')
     def _onchange_invoice_date_set_delivery(self):
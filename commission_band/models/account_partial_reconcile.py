@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, api
+
+
+class AccountPartialReconcile(models.Model):
+    _inherit = 'account.partial.reconcile'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override to queue commission calculation for newly reconciled payments"""
+        partials = super().create(vals_list)
+        partials._enqueue_commission_jobs()
+        return partials
+
+    def _enqueue_commission_jobs(self):
+        """Queue commission calculation for the payments reconciled by these partials
+        
+        Collects the inbound customer payments on both sides of every partial
+        at once, so a bank reconciliation or a manual matching gets its
+        commissions from the job worker within seconds instead of waiting for
+        the pending-commission sweep.
+        """
+        lines = self.debit_move_id | self.credit_move_id
+        payments = lines.payment_id.filtered(
+            lambda p: p.payment_type == 'inbound'
+            and p.partner_type == 'customer'
+            and not p.skip_commission_calculation
+        )
+        self.env['commission.job']._enqueue(payments.ids)
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+import json
 import logging
+import threading
 
 _logger = logging.getLogger(__name__)
 
+PENDING_CHUNK_SIZE_PARAM = 'commission_band.pending_payments_chunk_size'
+PENDING_PARTITIONS_PARAM = 'commission_band.pending_payments_partitions'
+DEFAULT_PENDING_CHUNK_SIZE = 500
+# Advisory lock class used to claim pending-commission partitions
+PENDING_PARTITION_LOCK = 530105
+
 
 class AccountPayment(models.Model):
     _inherit = 'account.payment'
@@ -19,19 +28,19 @@ class AccountPayment(models.Model):
     
     commission_calculation_count = fields.Integer(
         string='Commission Count',
-        compute='_compute_commission_count'
+        compute='_compute_commission_stats'
     )
     
     has_commission_calculations = fields.Boolean(
         string='Has Commissions',
-        compute='_compute_commission_count',
+        compute='_compute_has_commission_calculations',
         store=True,
         help="Indicates if this payment has generated commission calculations"
     )
     
     total_commission_amount = fields.Monetary(
         string='Total Commission',
-        compute='_compute_total_commission',
+        compute='_compute_commission_stats',
         currency_field='currency_id',
         help="Total commission amount generated from this payment"
     )
@@ -44,67 +53,75 @@ class AccountPayment(models.Model):
     
     can_calculate_commission = fields.Boolean(
         string='Can Calculate Commission',
-        compute='_compute_can_calculate_commission',
+        compute='_compute_commission_stats',
         help="Indicates if commission can be calculated for this payment"
     )
 
     @api.depends('commission_calculation_ids')
-    def _compute_commission_count(self):
+    def _compute_has_commission_calculations(self):
         for payment in self:
-            payment.commission_calculation_count = len(payment.commission_calculation_ids)
             payment.has_commission_calculations = bool(payment.commission_calculation_ids)
 
-    @api.depends('commission_calculation_ids.commission_amount', 'commission_calculation_ids.state')
-    def _compute_total_commission(self):
-        for payment in self:
-            valid_calculations = payment.commission_calculation_ids.filtered(
-                lambda c: c.state not in ['cancelled']
+    @api.depends('commission_calculation_ids', 'commission_calculation_ids.commission_amount',
+                 'commission_calculation_ids.state', 'commission_calculation_ids.currency_id',
+                 'payment_type', 'partner_type', 'is_reconciled', 'skip_commission_calculation',
+                 'state', 'date', 'currency_id')
+    def _compute_commission_stats(self):
+        """Compute the commission count, total and availability of the payments
+        
+        All payments are served by one grouped query, and the exchange rates
+        of the foreign currency commissions are loaded once.
+        """
+        # {payment_id: [count, active count, {currency_id: active amount}]}
+        stats = {}
+        payment_ids = self._origin.ids
+        if payment_ids:
+            rows = self.env['commission.calculation'].sudo()._read_group(
+                [('payment_id', 'in', payment_ids)],
+                ['payment_id', 'state', 'currency_id'],
+                ['__count', 'commission_amount:sum']
             )
-            # Sum commissions in payment currency
-            total = sum(valid_calculations.filtered(
-                lambda c: c.currency_id == payment.currency_id
-            ).mapped('commission_amount'))
+            for payment, state, currency, count, amount in rows:
+                payment_stats = stats.setdefault(payment.id, [0, 0, {}])
+                payment_stats[0] += count
+                if state != 'cancelled':
+                    payment_stats[1] += count
+                    payment_stats[2][currency.id] = payment_stats[2].get(currency.id, 0.0) + amount
+        
+        rate_table = self.env['res.currency']._get_commission_rate_table(
+            [currency_id for _count, _active, amounts in stats.values() for currency_id in amounts]
+            + self.currency_id.ids,
+            self.company_id,
+            min(filter(None, self.mapped('date')), default=None)
+        )
+        for payment in self:
+            count, active_count, amounts = stats.get(payment._origin.id, (0, 0, {}))
+            payment.commission_calculation_count = count
             
-            # Convert and sum commissions in other currencies
-            for calc in valid_calculations.filtered(lambda c: c.currency_id != payment.currency_id):
-                amount_converted = calc.currency_id._convert(
-                    calc.commission_amount,
-                    payment.currency_id,
-                    payment.company_id,
-                    payment.date
-                )
-                total += amount_converted
+            # Sum commissions converted to payment currency
+            payment.total_commission_amount = sum(
+                rate_table.convert(amount, currency_id, payment.currency_id.id, payment.company_id.id, payment.date)
+                for currency_id, amount in amounts.items()
+            )
             
-            payment.total_commission_amount = total
-
-    @api.depends('payment_type', 'partner_type', 'is_reconciled', 'skip_commission_calculation', 'state')
-    def _compute_can_calculate_commission(self):
-        """Compute if commission can be calculated for this payment"""
-        for payment in self:
-            can_calculate = (
+            # Only allow if there are no calculations or all existing are cancelled
+            payment.can_calculate_commission = (
                 payment.payment_type == 'inbound' and
                 payment.partner_type == 'customer' and
                 payment.is_reconciled and
                 not payment.skip_commission_calculation and
-                payment.state in ['posted', 'paid']  # Aceptar posted o paid
+                payment.state in ['posted', 'paid'] and  # Aceptar posted o paid
+                not active_count
             )
-            
-            # Check if there are already calculations
-            if can_calculate and payment.commission_calculation_ids:
-                # Only allow if all existing are cancelled
-                can_calculate = all(calc.state == 'cancelled' for calc in payment.commission_calculation_ids)
-            
-            payment.can_calculate_commission = can_calculate
 
     def action_post(self):
-        """Override to trigger commission calculation after payment is posted"""
+        """Override to queue commission calculation after payment is posted"""
         res = super().action_post()
         
-        # Trigger commission calculation for each payment
-        for payment in self:
-            if payment.payment_type == 'inbound' and not payment.skip_commission_calculation:
-                # Try to calculate immediately if already reconciled
-                payment._trigger_commission_calculation()
+        # Calculation runs in the commission job worker, outside of the posting request
+        self.env['commission.job']._enqueue(self.filtered(
+            lambda p: p.payment_type == 'inbound' and not p.skip_commission_calculation
+        ).ids)
         
         return res
 
@@ -114,63 +131,69 @@ class AccountPayment(models.Model):
         
         # Solo manejar el caso donde skip_commission_calculation se desactiva
         if 'skip_commission_calculation' in vals and not vals['skip_commission_calculation']:
-            for payment in self.filtered(lambda p: p.is_reconciled and p.payment_type == 'inbound'):
-                if not payment.commission_calculation_ids.filtered(lambda c: c.state != 'cancelled'):
-                    payment._trigger_commission_calculation()
+            self.env['commission.job']._enqueue(self.filtered(
+                lambda p: p.is_reconciled and p.payment_type == 'inbound'
+            ).ids)
         
         return res
 
+    def _get_commission_pending_payments(self):
+        """Return the payments in self that may need a commission calculation
+        
+        Payments with existing calculations are kept: invoices reconciled after
+        the first calculation still need theirs, and the calculation engine
+        skips payment/invoice pairs that are already calculated.
+        """
+        pending = self.env['account.payment']
+        for payment in self:
+            # Only process customer payments
+            if payment.payment_type != 'inbound' or payment.partner_type != 'customer':
+                _logger.info("Payment %s is not a customer payment. Skipping commission calculation.", payment.name)
+                continue
+            
+            # Check if payment is reconciled
+            if not payment.is_reconciled:
+                _logger.info("Payment %s is not reconciled. Commission will be calculated when reconciled.", payment.name)
+                continue
+            
+            # Check if commission calculation should be skipped
+            if payment.skip_commission_calculation:
+                _logger.info("Commission calculation skipped for payment %s as per user request.", payment.name)
+                continue
+            
+            # Check reconciled invoices
+            if not payment.reconciled_invoice_ids:
+                _logger.warning("No reconciled invoices found for payment %s", payment.name)
+                continue
+            
+            pending |= payment
+        return pending
+
     def _trigger_commission_calculation(self):
-        """Trigger commission calculation when payment is reconciled"""
-        self.ensure_one()
-        
-        _logger.info("=== Starting commission calculation for payment %s ===", self.name)
+        """Trigger commission calculation for the reconciled payments in self
         
-        # Only process customer payments
-        if self.payment_type != 'inbound' or self.partner_type != 'customer':
-            _logger.info("Payment %s is not a customer payment. Skipping commission calculation.", self.name)
-            return
+        All pending payments are delegated to the commission calculation engine
+        in one call, so rules, configurations and existing calculations are
+        loaded once for the whole set.
+        """
+        pending_payments = self._get_commission_pending_payments()
+        if not pending_payments:
+            return self.env['commission.calculation']
         
-        # Check if payment is reconciled
-        if not self.is_reconciled:
-            _logger.info("Payment %s is not reconciled. Commission will be calculated when reconciled.", self.name)
-            return
-        
-        # Check if commission calculation should be skipped
-        if self.skip_commission_calculation:
-            _logger.info("Commission calculation skipped for payment %s as per user request.", self.name)
-            return
-        
-        # Check if commissions already calculated
-        existing_calculations = self.commission_calculation_ids.filtered(
-            lambda c: c.state != 'cancelled'
-        )
-        if existing_calculations:
-            _logger.info("Commission already calculated for payment %s. Found %d existing calculations.", 
-                        self.name, len(existing_calculations))
-            return
-        
-        # Get reconciled invoices
-        reconciled_invoices = self.reconciled_invoice_ids
-        if not reconciled_invoices:
-            _logger.warning("No reconciled invoices found for payment %s", self.name)
-            return
-        
-        _logger.info("Found %d reconciled invoices for payment %s", len(reconciled_invoices), self.name)
+        _logger.info("=== Starting commission calculation for %d payments ===", len(pending_payments))
         
         # Delegate to commission calculation model
-        calculation_model = self.env['commission.calculation']
-        calculation_model._calculate_commission_from_payment(self.id)
-        
-        # Check if calculations were created
-        new_calculations = self.commission_calculation_ids.filtered(
-            lambda c: c.state != 'cancelled'
+        calculations = self.env['commission.calculation']._calculate_commission_from_payments(
+            pending_payments.ids
         )
-        if new_calculations:
-            _logger.info("Successfully created %d commission calculations for payment %s", 
-                        len(new_calculations), self.name)
+        
+        if calculations:
+            _logger.info("Successfully created %d commission calculations for %d payments", 
+                        len(calculations), len(pending_payments))
         else:
-            _logger.warning("No commission calculations were created for payment %s", self.name)
+            _logger.warning("No commission calculations were created for payments %s",
+                            ', '.join(pending_payments.mapped('name')))
+        return calculations
 
     def action_view_commission_calculations(self):
         """Action to view commission calculations for this payment"""
@@ -249,34 +272,272 @@ class AccountPayment(models.Model):
         }
 
     @api.model
-    def _cron_calculate_pending_commissions(self):
-        """Cron job to calculate commissions for reconciled payments without calculations"""
-        # Find reconciled customer payments without commission calculations
-        domain = [
-            ('payment_type', '=', 'inbound'),
-            ('partner_type', '=', 'customer'),
-            ('is_reconciled', '=', True),
-            ('skip_commission_calculation', '=', False),
-            ('state', 'in', ['posted', 'paid']),  # Incluir tanto posted como paid
-        ]
-        
-        payments = self.search(domain)
-        
-        # Filter payments without valid commission calculations
-        # Usar la misma lógica que skip_commission
-        pending_payments = payments.filtered(
-            lambda p: not p.commission_calculation_ids.filtered(lambda c: c.state != 'cancelled')
-        )
-        
-        _logger.info("Found %d payments pending commission calculation", len(pending_payments))
-        
-        for payment in pending_payments:
+    def _get_pending_commission_payment_ids(self, since=None, after_id=0, limit=None,
+                                            partition=0, partitions=1, retry_ids=None):
+        """Find reconciled customer payments with invoices left to calculate
+        
+        A payment is pending while one of its reconciled invoices with a
+        salesperson has no valid commission calculation for the pair. Uses a
+        single NOT EXISTS anti-join on (payment, invoice) against
+        commission_calculation instead of loading every payment and its
+        calculations in memory.
+        
+        Args:
+            since: datetime high-water mark (optional). When set, only payments
+                written or reconciled after it are returned.
+            after_id: only return payments with a greater ID (resume point)
+            limit: maximum number of IDs to return (optional)
+            partition: partition to scan, between 0 and partitions - 1
+            partitions: number of partitions, payments are split by ID modulo
+            retry_ids: IDs of payments returned even if unchanged since the
+                high-water mark, e.g. those that failed in the previous pass
+                
+        Returns:
+            list: IDs of the pending payments, in ascending order
+        """
+        self.flush_model([
+            'payment_type', 'partner_type', 'is_reconciled',
+            'skip_commission_calculation', 'state',
+        ])
+        self.env['commission.calculation'].flush_model(['payment_id', 'invoice_id', 'state'])
+        self.env['account.move'].flush_model(['move_type', 'invoice_user_id'])
+        self.env['account.move.line'].flush_model(['move_id', 'account_id'])
+        self.env['account.partial.reconcile'].flush_model(['debit_move_id', 'credit_move_id'])
+        
+        query = """
+            SELECT p.id
+              FROM account_payment p
+             WHERE p.id > %(after_id)s
+               AND p.payment_type = 'inbound'
+               AND p.partner_type = 'customer'
+               AND p.is_reconciled
+               AND p.skip_commission_calculation IS NOT TRUE
+               AND p.state IN ('posted', 'paid')
+               AND EXISTS (
+                    SELECT 1
+                      FROM account_move_line line
+                      JOIN account_account account ON account.id = line.account_id
+                      JOIN account_partial_reconcile part
+                        ON part.debit_move_id = line.id OR part.credit_move_id = line.id
+                      JOIN account_move_line counterpart
+                        ON (part.debit_move_id = counterpart.id OR part.credit_move_id = counterpart.id)
+                       AND counterpart.id != line.id
+                      JOIN account_move invoice ON invoice.id = counterpart.move_id
+                     WHERE line.move_id = p.move_id
+                       AND account.account_type = 'asset_receivable'
+                       AND invoice.move_type IN ('out_invoice', 'out_refund', 'out_receipt')
+                       AND invoice.invoice_user_id IS NOT NULL
+                       AND NOT EXISTS (
+                            SELECT 1
+                              FROM commission_calculation c
+                             WHERE c.payment_id = p.id
+                               AND c.invoice_id = invoice.id
+                               AND c.state != 'cancelled'
+                       )
+               )
+        """
+        if partitions > 1:
+            query += " AND p.id %% %(partitions)s = %(partition)s"
+        if since:
+            # New or changed payments, including those reconciled afterwards
+            query += """
+               AND (p.id = ANY(%(retry_ids)s) OR p.write_date >= %(since)s OR EXISTS (
+                    SELECT 1
+                      FROM account_move_line l
+                      JOIN account_partial_reconcile apr
+                        ON apr.credit_move_id = l.id OR apr.debit_move_id = l.id
+                     WHERE l.move_id = p.move_id
+                       AND apr.create_date >= %(since)s
+               ))
+            """
+        query += " ORDER BY p.id LIMIT %(limit)s"
+        
+        self.env.cr.execute(query, {
+            'since': since,
+            'retry_ids': list(retry_ids or []),
+            'after_id': after_id,
+            'limit': limit,
+            'partition': partition,
+            'partitions': partitions,
+        })
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _process_pending_commission_chunk(self, payments):
+        """Calculate commissions for a chunk of payments under savepoints
+        
+        The chunk is first calculated as a whole. If that fails, every payment
+        is retried under its own savepoint, so one failing payment neither
+        aborts the transaction nor blocks the rest of the chunk.
+        
+        Returns:
+            account.payment: the payments whose calculation failed
+        """
+        try:
+            with self.env.cr.savepoint():
+                payments._trigger_commission_calculation()
+            return self.browse()
+        except Exception as e:
+            _logger.error("Error calculating commissions in bulk, retrying per payment: %s", str(e))
+        
+        failed = self.browse()
+        for payment in payments:
             try:
-                payment._trigger_commission_calculation()
+                with self.env.cr.savepoint():
+                    payment._trigger_commission_calculation()
             except Exception as e:
                 _logger.error("Error calculating commission for payment %s: %s", payment.name, str(e))
+                failed |= payment
+        return failed
+
+    @api.model
+    def _cron_calculate_pending_commissions(self, full_rescan=False):
+        """Cron job to calculate commissions for reconciled payments without calculations
+        
+        Only payments changed since the last completed pass are considered,
+        using the high-water mark stored in the commission_pending_partition
+        table. Payments that failed during a pass are kept in the checkpoint
+        and looked at again by the next pass, as the mark moves past them.
+        
+        The workload is split into commission_band.pending_payments_partitions
+        partitions (payment ID modulo the partition count, 1 by default).
+        Every partition is claimed with pg_try_advisory_xact_lock, so several
+        cron workers or processes can run this method at the same time: each
+        one skips the partitions already claimed by another.
+        
+        Payments are processed in chunks of
+        commission_band.pending_payments_chunk_size (500 by default). Every
+        chunk is committed and a resume checkpoint is stored with a plain
+        upsert, which leaves the registry caches alone, then the cron
+        triggers itself again until the backlog is empty.
+        
+        Args:
+            full_rescan: if True, ignore the high-water mark and look at every
+                reconciled customer payment (repair mode)
+        """
+        IrConfig = self.env['ir.config_parameter'].sudo()
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        chunk_size = int(IrConfig.get_param(PENDING_CHUNK_SIZE_PARAM, DEFAULT_PENDING_CHUNK_SIZE))
+        partitions = max(1, int(IrConfig.get_param(PENDING_PARTITIONS_PARAM, 1)))
+        
+        backlog = False
+        for partition in range(partitions):
+            # Released by the commit at the end of the chunk
+            self.env.cr.execute(
+                "SELECT pg_try_advisory_xact_lock(%s, %s)",
+                [PENDING_PARTITION_LOCK, partition]
+            )
+            if not self.env.cr.fetchone()[0]:
+                _logger.info("Pending commission partition %d/%d is being processed by another worker",
+                             partition + 1, partitions)
                 continue
+            
+            backlog |= self._calculate_pending_commission_partition(
+                partition, partitions, chunk_size, full_rescan
+            )
+            if auto_commit:
+                self.env.cr.commit()
+        
+        if backlog:
+            # More payments are pending, run again as soon as possible
+            self.env.ref('commission_band.ir_cron_calculate_pending_commissions')._trigger()
+        return True
+
+    def init(self):
+        # State of the pending-commission sweep, one row per partition. It is
+        # not kept in ir_config_parameter, whose writes clear the registry
+        # caches of every worker in the middle of the sweep relying on them
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS commission_pending_partition (
+                partitions integer NOT NULL,
+                partition integer NOT NULL,
+                watermark timestamp,
+                checkpoint jsonb,
+                PRIMARY KEY (partitions, partition)
+            )
+        """)
+
+    @api.model
+    def _get_pending_partition_state(self, partition, partitions):
+        """Return the stored state of a partition
+        
+        Returns:
+            tuple: (high-water mark as a string or False, checkpoint dict)
+        """
+        self.env.cr.execute("""
+            SELECT watermark, checkpoint
+              FROM commission_pending_partition
+             WHERE partitions = %s
+               AND partition = %s
+        """, [partitions, partition])
+        row = self.env.cr.fetchone()
+        if not row:
+            return False, {}
+        return fields.Datetime.to_string(row[0]) if row[0] else False, row[1] or {}
+
+    @api.model
+    def _set_pending_partition_state(self, partition, partitions, checkpoint, watermark=None):
+        """Store the state of a partition, keeping its mark unless one is given"""
+        self.env.cr.execute("""
+            INSERT INTO commission_pending_partition AS s (partitions, partition, watermark, checkpoint)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (partitions, partition) DO UPDATE
+               SET watermark = COALESCE(EXCLUDED.watermark, s.watermark),
+                   checkpoint = EXCLUDED.checkpoint
+        """, [partitions, partition, watermark, json.dumps(checkpoint) if checkpoint else None])
+
+    @api.model
+    def _calculate_pending_commission_partition(self, partition, partitions, chunk_size, full_rescan=False):
+        """Process one chunk of a claimed pending-commission partition
+        
+        Returns:
+            bool: True if the partition still has pending payments
+        """
+        watermark, checkpoint = self._get_pending_partition_state(partition, partitions)
+        if not watermark and partitions > 1:
+            # New partition layout: start from the layout-independent mark
+            watermark = self._get_pending_partition_state(0, 1)[0]
+        
+        # Resume the current pass, or start a new one retrying the payments
+        # that failed in the previous one
+        if not checkpoint.get('started') or (full_rescan and checkpoint.get('since')):
+            checkpoint = {
+                'last_id': 0,
+                'since': False if full_rescan else watermark,
+                'started': fields.Datetime.to_string(self.env.cr.now()),
+                'retry_ids': checkpoint.get('retry_ids', []),
+                'failed_ids': [],
+            }
+        
+        payment_ids = self._get_pending_commission_payment_ids(
+            since=fields.Datetime.to_datetime(checkpoint['since']),
+            after_id=checkpoint['last_id'],
+            limit=chunk_size,
+            partition=partition,
+            partitions=partitions,
+            retry_ids=checkpoint.get('retry_ids'),
+        )
+        
+        _logger.info("Processing %d payments pending commission calculation in partition %d/%d after payment ID %s",
+                     len(payment_ids), partition + 1, partitions, checkpoint['last_id'])
+        
+        failed = self._process_pending_commission_chunk(self.browse(payment_ids))
+        failed_ids = checkpoint.get('failed_ids', []) + failed.ids
+        
+        if len(payment_ids) < chunk_size:
+            # Backlog drained: move the high-water mark and end the pass. The
+            # mark moves past the failed payments, so they are kept for the
+            # next pass
+            self._set_pending_partition_state(
+                partition, partitions,
+                {'retry_ids': failed_ids} if failed_ids else False,
+                watermark=checkpoint['started'],
+            )
+            return False
         
+        checkpoint['failed_ids'] = failed_ids
+        checkpoint['last_id'] = payment_ids[-1]
+        self._set_pending_partition_state(partition, partitions, checkpoint)
         return True
 
     # Debug method
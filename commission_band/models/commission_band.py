@@ -1,7 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import SQL
+from bisect import bisect_right
+from collections import namedtuple
+
+# Compiled ranges of one band, as parallel tuples sorted by day_from
+#   currency_id: currency the band is restricted to (False if none)
+#   day_from, day_to: bounds of each range (inclusive)
+#   rate, indicator_rate: rates already divided by 100
+#   range_id: commission.range ID of each range
+#   min_amount, currency_only: per-range constraints (0.0 / False if none)
+BandRateTable = namedtuple('BandRateTable', [
+    'currency_id', 'day_from', 'day_to', 'rate', 'indicator_rate',
+    'range_id', 'min_amount', 'currency_only',
+])
 
 
 class CommissionBand(models.Model):
@@ -65,8 +79,14 @@ class CommissionBand(models.Model):
         copy=True,
         help="Define the commission percentages for different day ranges"
     )
+    rule_ids = fields.One2many(
+        'commission.rule',
+        'band_id',
+        string='Rules'
+    )
     
-    # Statistics - Made searchable with store=True
+    # Statistics - Made searchable with store=True. calculation_count has a
+    # search method instead (see commission.calculation._get_calculation_counts)
     rule_count = fields.Integer(
         string='Number of Rules',
         compute='_compute_rule_count',
@@ -75,7 +95,7 @@ class CommissionBand(models.Model):
     calculation_count = fields.Integer(
         string='Number of Calculations',
         compute='_compute_calculation_count',
-        store=True
+        search='_search_calculation_count'
     )
     
     # Display
@@ -100,38 +120,31 @@ class CommissionBand(models.Model):
                 name += f" ({band.currency_id.name})"
             band.display_name = name
 
+    @api.depends('rule_ids', 'rule_ids.active')
     def _compute_rule_count(self):
         """Compute the number of rules using this band"""
+        counts = dict(self.env['commission.rule']._read_group(
+            [('band_id', 'in', self.ids)], ['band_id'], ['__count']
+        ))
         for band in self:
-            band.rule_count = self.env['commission.rule'].search_count([
-                ('band_id', '=', band.id)
-            ])
+            band.rule_count = counts.get(band._origin, 0)
 
     def _compute_calculation_count(self):
         """Compute the number of calculations using this band"""
+        counts = self.env['commission.calculation']._get_calculation_counts('band_id', self._origin.ids)
         for band in self:
-            band.calculation_count = self.env['commission.calculation'].search_count([
-                ('band_id', '=', band.id)
-            ])
+            band.calculation_count = counts.get(band._origin.id, 0)
 
-    @api.constrains('range_ids')
-    def _check_range_overlap(self):
-        """Ensure day ranges don't overlap within the same band"""
-        for band in self:
-            ranges = band.range_ids.sorted('day_from')
-            for i in range(len(ranges) - 1):
-                if ranges[i].day_to >= ranges[i + 1].day_from:
-                    raise ValidationError(_(
-                        "Day ranges cannot overlap! Range '%s' (%s to %s days) "
-                        "overlaps with range '%s' (%s to %s days)."
-                    ) % (
-                        ranges[i].name,
-                        ranges[i].day_from,
-                        ranges[i].day_to,
-                        ranges[i + 1].name,
-                        ranges[i + 1].day_from,
-                        ranges[i + 1].day_to
-                    ))
+    def _search_calculation_count(self, operator, value):
+        if operator not in ('=', '!=', '<', '<=', '>', '>='):
+            raise UserError(_("Operation not supported"))
+        query = self._search([])
+        query.add_where(SQL(
+            "%s %s %s",
+            self.env['commission.calculation']._get_calculation_count_subquery('band_id', query.table),
+            SQL(operator), value or 0
+        ))
+        return [('id', 'in', query)]
 
     @api.constrains('range_ids')
     def _check_range_coverage(self):
@@ -179,6 +192,77 @@ class CommissionBand(models.Model):
             'domain': [('band_id', '=', self.id)],
         }
 
+    def write(self, vals):
+        if 'range_ids' not in vals:
+            res = super().write(vals)
+        else:
+            # Range commands are flushed row by row, so shifting the bounds of
+            # two neighbour ranges may overlap in between: check the overlap
+            # constraint on the final state only. The savepoint also reverts
+            # the DEFERRED mode when the write fails
+            with self.env.cr.savepoint():
+                self.env.cr.execute("SET CONSTRAINTS commission_range_day_range_excl DEFERRED")
+                res = super().write(vals)
+                self.env['commission.range'].flush_model()
+                self.env.cr.execute("SET CONSTRAINTS commission_range_day_range_excl IMMEDIATE")
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('band_id')
+    def _get_rate_table(self, band_id):
+        """Compile the ranges of a band into sorted parallel arrays
+        
+        Ranges never overlap (see the exclusion constraint of
+        commission.range), so a binary search on day_from finds the only
+        candidate range. The table is cached at registry level and
+        invalidated when bands or ranges change.
+        
+        Args:
+            band_id: ID of the commission.band
+            
+        Returns:
+            BandRateTable: compiled ranges of the band
+        """
+        band = self.sudo().browse(band_id)
+        ranges = band.range_ids.sorted(lambda r: (r.day_from, r.sequence, r.id))
+        return BandRateTable(
+            currency_id=band.currency_id.id if band.currency_specific and band.currency_id else False,
+            day_from=tuple(ranges.mapped('day_from')),
+            day_to=tuple(ranges.mapped('day_to')),
+            rate=tuple(r.commission_rate / 100.0 for r in ranges),
+            indicator_rate=tuple(r.indicator_rate / 100.0 for r in ranges),
+            range_id=tuple(ranges.ids),
+            min_amount=tuple(r.min_payment_amount or 0.0 for r in ranges),
+            currency_only=tuple(r.apply_only_currency_id.id for r in ranges),
+        )
+
+    @api.model
+    def _lookup_rate(self, table, days_overdue, payment_amount, currency_id):
+        """Find the commission rate of a compiled band table
+        
+        Returns:
+            tuple: (commission_rate, indicator_rate, range_id)
+        """
+        # Check currency compatibility
+        if table.currency_id and (not currency_id or currency_id != table.currency_id):
+            return (0.0, 0.0, False)
+        
+        idx = bisect_right(table.day_from, days_overdue) - 1
+        if idx < 0 or days_overdue > table.day_to[idx]:
+            return (0.0, 0.0, False)
+        if table.min_amount[idx] and payment_amount < table.min_amount[idx]:
+            return (0.0, 0.0, False)
+        if table.currency_only[idx] and table.currency_only[idx] != currency_id:
+            return (0.0, 0.0, False)
+        
+        return (table.rate[idx], table.indicator_rate[idx], table.range_id[idx])
+
     @api.model
     def get_commission_rate(self, days_overdue, payment_amount=0, currency_id=None):
         """Get the commission rate for a given number of days overdue
@@ -192,29 +276,29 @@ class CommissionBand(models.Model):
             tuple: (commission_rate, indicator_rate, range_id)
         """
         self.ensure_one()
+        return self._lookup_rate(self._get_rate_table(self.id), days_overdue, payment_amount, currency_id)
+
+    def get_commission_rates(self, days_array, amounts_array, currency_ids):
+        """Get the commission rates of this band for many payments at once
         
-        # Check currency compatibility
-        if self.currency_specific and self.currency_id:
-            if not currency_id or currency_id != self.currency_id.id:
-                return (0.0, 0.0, False)
-        
-        # Find applicable range
-        applicable_range = self.range_ids.filtered(
-            lambda r: r.day_from <= days_overdue <= r.day_to and
-            (not r.min_payment_amount or payment_amount >= r.min_payment_amount) and
-            (not r.apply_only_currency_id or r.apply_only_currency_id.id == currency_id)
-        )
-        
-        if applicable_range:
-            # Get the first range (should be only one due to overlap validation)
-            range_rec = applicable_range[0]
-            return (
-                range_rec.commission_rate / 100.0,
-                range_rec.indicator_rate / 100.0,
-                range_rec.id
-            )
+        Args:
+            days_array: sequence of days overdue
+            amounts_array: sequence of payment amounts
+            currency_ids: sequence of payment currency IDs, or a single ID
+                shared by all payments
         
-        return (0.0, 0.0, False)
+        Returns:
+            list: (commission_rate, indicator_rate, range_id) tuples, in the
+            order of the input arrays
+        """
+        self.ensure_one()
+        table = self._get_rate_table(self.id)
+        if not isinstance(currency_ids, (list, tuple)):
+            currency_ids = [currency_ids] * len(days_array)
+        return [
+            self._lookup_rate(table, days, amount, currency_id)
+            for days, amount, currency_id in zip(days_array, amounts_array, currency_ids)
+        ]
 
     def copy(self, default=None):
         default = dict(default or {})
@@ -1,12 +1,25 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api, _
-from odoo.exceptions import UserError, ValidationError
+from odoo.exceptions import UserError
+from odoo.tools import SQL
 from dateutil.relativedelta import relativedelta
 import logging
+import threading
 
 _logger = logging.getLogger(__name__)
 
+BATCH_JOB_CHUNK_SIZE_PARAM = 'commission_band.batch_job_chunk_size'
+DEFAULT_BATCH_JOB_CHUNK_SIZE = 1000
+# Transient states of a batch processed in background, with the method doing
+# the work and the state reached once it is done
+BATCH_JOBS = {
+    'calculating': ('_job_calculate', 'calculated'),
+    'generating': ('_job_generate_payment_document', 'payment_generated'),
+    'paying': ('_job_mark_paid', 'paid'),
+    'resetting': ('_job_reset_draft', 'draft'),
+}
+
 
 class CommissionBatch(models.Model):
     _name = 'commission.batch'
@@ -44,10 +57,14 @@ class CommissionBatch(models.Model):
     # State
     state = fields.Selection([
         ('draft', 'Draft'),
+        ('calculating', 'Calculating'),
         ('calculated', 'Calculated'),
         ('reviewed', 'Reviewed by Sales'),
+        ('generating', 'Generating Payment Document'),
         ('payment_generated', 'Payment Document Generated'),
-        ('paid', 'Paid')
+        ('paying', 'Marking as Paid'),
+        ('paid', 'Paid'),
+        ('resetting', 'Resetting to Draft')
     ], string='State', default='draft', required=True, tracking=True, index=True)
     
     # Relations
@@ -128,66 +145,239 @@ class CommissionBatch(models.Model):
         tracking=True
     )
     
+    # Background processing
+    job_user_id = fields.Many2one(
+        'res.users',
+        string='Processing Launched By',
+        readonly=True
+    )
+    job_date_start = fields.Datetime(
+        string='Processing Started On',
+        readonly=True,
+        help="When the worker started processing the batch, not when it was queued"
+    )
+    job_done = fields.Integer(
+        string='Processed Items',
+        readonly=True
+    )
+    job_total = fields.Integer(
+        string='Items to Process',
+        readonly=True
+    )
+    job_progress = fields.Float(
+        string='Progress',
+        compute='_compute_job_progress'
+    )
+    job_eta = fields.Datetime(
+        string='Estimated End',
+        compute='_compute_job_progress',
+        help="Estimated from the time taken by the chunks already processed"
+    )
+    job_error = fields.Text(
+        string='Processing Error',
+        readonly=True,
+        help="Set when the background processing failed. The batch keeps its "
+             "transient state until the processing is retried"
+    )
+    
     _sql_constraints = [
         ('date_check', 'CHECK (date_from <= date_to)', 
          'The start date must be before or equal to the end date!'),
+        # int4range(company_id, company_id) turns the company equality into a
+        # range overlap, so the constraint needs no btree_gist extension
+        ('period_excl', "EXCLUDE USING gist ("
+                        "int4range(company_id, company_id, '[]') WITH &&, "
+                        "daterange(date_from, date_to, '[]') WITH &&)",
+         'There is already a batch covering this period!'),
     ]
 
-    @api.depends('company_id')
+    @api.depends('company_id', 'company_id.commission_primary_currency_id',
+                 'company_id.commission_secondary_currency_id')
     def _compute_currencies(self):
         for batch in self:
-            usd = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-            ves = self.env['res.currency'].search([('name', '=', 'VES')], limit=1)
-            batch.currency_usd_id = usd
-            batch.currency_ves_id = ves
+            usd_id, ves_id = batch.company_id._get_commission_currency_ids()
+            batch.currency_usd_id = usd_id
+            batch.currency_ves_id = ves_id
 
-    @api.depends('calculation_ids', 'calculation_ids.state', 'calculation_ids.commission_amount', 
-                 'calculation_ids.currency_id')
-    def _compute_statistics(self):
+    @api.depends('state', 'job_done', 'job_total', 'job_date_start')
+    def _compute_job_progress(self):
+        now = fields.Datetime.now()
         for batch in self:
-            valid_calculations = batch.calculation_ids.filtered(
-                lambda c: c.state not in ['cancelled']
+            done, total = batch.job_done, batch.job_total
+            batch.job_progress = 100.0 * done / total if total else 0.0
+            if batch.state in BATCH_JOBS and done and batch.job_date_start:
+                batch.job_eta = now + (now - batch.job_date_start) * ((total - done) / done)
+            else:
+                batch.job_eta = False
+    
+    # Statistics are not recomputed on every calculation change: calculations
+    # apply their delta through _apply_calculation_contributions, and
+    # _cron_reconcile_statistics periodically recomputes them exactly
+    @api.depends('currency_usd_id', 'currency_ves_id')
+    def _compute_statistics(self):
+        Calculation = self.env['commission.calculation']
+        domain = [('batch_id', 'in', self._origin.ids), ('state', 'not in', ['cancelled'])]
+        counts = {
+            batch.id: (count, salesperson_count)
+            for batch, count, salesperson_count in Calculation._read_group(
+                domain, ['batch_id'], ['__count', 'salesperson_id:count_distinct']
             )
-            
-            batch.calculation_count = len(valid_calculations)
-            batch.salesperson_count = len(valid_calculations.mapped('salesperson_id'))
+        }
+        amounts = Calculation._read_group(
+            domain, ['batch_id', 'currency_id', 'payment_date:day'], ['commission_amount:sum']
+        )
+        rate_table = self.env['res.currency']._get_commission_rate_table(
+            [currency.id for _batch, currency, _date, _amount in amounts] + self.currency_usd_id.ids,
+            self.company_id,
+            min(filter(None, (date for _batch, _currency, date, _amount in amounts)), default=None)
+        )
+        totals = {}
+        for batch, currency, date, amount in amounts:
+            totals.setdefault(batch.id, []).append((currency.id, date, amount))
+        
+        today = fields.Date.today()
+        for batch in self:
+            count, salesperson_count = counts.get(batch._origin.id, (0, 0))
+            batch.calculation_count = count
+            batch.salesperson_count = salesperson_count
             
             # Calculate totals by currency
             total_usd = 0.0
             total_ves = 0.0
             
-            for calc in valid_calculations:
-                if calc.currency_id.name == 'USD':
-                    total_usd += calc.commission_amount
-                elif calc.currency_id.name == 'VES':
-                    total_ves += calc.commission_amount
+            usd_id = batch.currency_usd_id.id
+            ves_id = batch.currency_ves_id.id
+            for currency_id, date, amount in totals.get(batch._origin.id, []):
+                if currency_id == usd_id:
+                    total_usd += amount
+                elif currency_id == ves_id:
+                    total_ves += amount
                 else:
                     # Convert to USD for other currencies
-                    amount_usd = calc.currency_id._convert(
-                        calc.commission_amount,
-                        batch.currency_usd_id,
-                        batch.company_id,
-                        calc.payment_date or fields.Date.today()
+                    total_usd += rate_table.convert(
+                        amount,
+                        currency_id,
+                        usd_id,
+                        batch.company_id.id,
+                        date or today
                     )
-                    total_usd += amount_usd
             
             batch.total_commission_usd = total_usd
             batch.total_commission_ves = total_ves
 
-    @api.constrains('date_from', 'date_to')
-    def _check_dates(self):
-        for batch in self:
-            # Check for overlapping batches
-            domain = [
-                ('id', '!=', batch.id),
-                ('company_id', '=', batch.company_id.id),
-                ('state', '!=', 'cancelled'),
-                '|',
-                '&', ('date_from', '<=', batch.date_from), ('date_to', '>=', batch.date_from),
-                '&', ('date_from', '<=', batch.date_to), ('date_to', '>=', batch.date_to),
-            ]
-            if self.search(domain):
-                raise ValidationError(_("There is already a batch covering this period!"))
+    @api.model
+    def _get_calculation_contributions(self, calculations):
+        """Get what calculations add to the statistics of their batches
+        
+        Args:
+            calculations: commission.calculation recordset
+        
+        Returns:
+            dict: {batch_id: [count, total USD, total VES, salesperson IDs]}
+        """
+        calculations = calculations.filtered(lambda c: c.batch_id and c.state != 'cancelled')
+        if not calculations:
+            return {}
+        
+        batches = calculations.batch_id
+        rate_table = self.env['res.currency']._get_commission_rate_table(
+            calculations.currency_id.ids + batches.currency_usd_id.ids,
+            batches.company_id,
+            min(filter(None, calculations.mapped('payment_date')), default=None)
+        )
+        today = fields.Date.today()
+        contributions = {}
+        for calc in calculations:
+            batch = calc.batch_id
+            values = contributions.setdefault(batch.id, [0, 0.0, 0.0, set()])
+            values[0] += 1
+            values[3].add(calc.salesperson_id.id)
+            currency_id = calc.currency_id.id
+            if currency_id == batch.currency_usd_id.id:
+                values[1] += calc.commission_amount
+            elif currency_id == batch.currency_ves_id.id:
+                values[2] += calc.commission_amount
+            else:
+                values[1] += rate_table.convert(
+                    calc.commission_amount,
+                    currency_id,
+                    batch.currency_usd_id.id,
+                    batch.company_id.id,
+                    calc.payment_date or today
+                )
+        return contributions
+
+    @api.model
+    def _apply_calculation_contributions(self, before, after):
+        """Update batch statistics with the change of some calculations
+        
+        Only the changed calculations are looked at, so bulk workflow actions
+        on big batches stay linear.
+        
+        Args:
+            before: contributions of the calculations before the change
+            after: contributions of the calculations after the change
+        """
+        batch_ids = sorted(set(before) | set(after))
+        if not batch_ids:
+            return
+        
+        self.flush_model()
+        recount_ids = []
+        for batch_id in batch_ids:
+            old = before.get(batch_id, [0, 0.0, 0.0, set()])
+            new = after.get(batch_id, [0, 0.0, 0.0, set()])
+            if old[3] != new[3]:
+                recount_ids.append(batch_id)
+            delta = [new_value - old_value for old_value, new_value in zip(old[:3], new[:3])]
+            if any(delta):
+                self.env.cr.execute("""
+                    UPDATE commission_batch
+                       SET calculation_count = COALESCE(calculation_count, 0) + %s,
+                           total_commission_usd = COALESCE(total_commission_usd, 0) + %s,
+                           total_commission_ves = COALESCE(total_commission_ves, 0) + %s
+                     WHERE id = %s
+                """, delta + [batch_id])
+        
+        # Distinct salespeople cannot be maintained by deltas, recount the
+        # batches where the changed calculations' salespeople differ
+        if recount_ids:
+            self.env['commission.calculation'].flush_model(['batch_id', 'state', 'salesperson_id'])
+            self.env.cr.execute("""
+                UPDATE commission_batch b
+                   SET salesperson_count = (
+                        SELECT COUNT(DISTINCT c.salesperson_id)
+                          FROM commission_calculation c
+                         WHERE c.batch_id = b.id
+                           AND c.state != 'cancelled'
+                   )
+                 WHERE b.id = ANY(%s)
+            """, [recount_ids])
+        self.browse(batch_ids).invalidate_recordset([
+            'calculation_count', 'salesperson_count', 'total_commission_usd', 'total_commission_ves',
+        ])
+
+    @api.model
+    def _cron_reconcile_statistics(self, batch_size=100):
+        """Recompute the statistics of all batches exactly
+        
+        Repairs the drift left by delta maintenance, e.g. exchange rates
+        changed after the fact or calculations deleted by cascade.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        batch_ids = self.search([]).ids
+        for start in range(0, len(batch_ids), batch_size):
+            self.browse(batch_ids[start:start + batch_size])._recompute_statistics()
+            if auto_commit:
+                self.env.cr.commit()
+            self.env.invalidate_all()
+        return True
+
+    def _recompute_statistics(self):
+        """Recompute the statistics of these batches exactly, in one pass"""
+        for fname in ('calculation_count', 'salesperson_count', 'total_commission_usd', 'total_commission_ves'):
+            self.env.add_to_compute(self._fields[fname], self)
+        self.flush_recordset()
 
     @api.onchange('date_from')
     def _onchange_date_from(self):
@@ -204,46 +394,28 @@ class CommissionBatch(models.Model):
             if not self.name:
                 self.name = _("Commissions %s") % self.date_from.strftime('%B %Y')
 
-    def action_calculate(self):
-        """Calculate commissions for this batch"""
+    def _get_calculation_domain(self):
+        """Domain of the calculations of the period not yet in a batch"""
         self.ensure_one()
-        
-        if self.state != 'draft':
-            raise UserError(_("Only draft batches can be calculated."))
-        
-        # Find commission calculations in the period without batch
-        domain = [
+        return [
             ('payment_date', '>=', self.date_from),
             ('payment_date', '<=', self.date_to),
             ('batch_id', '=', False),
             ('state', 'not in', ['cancelled']),
             ('company_id', '=', self.company_id.id)
         ]
+
+    def action_calculate(self):
+        """Calculate commissions for this batch"""
+        self.ensure_one()
         
-        calculations = self.env['commission.calculation'].search(domain)
+        if self.state != 'draft':
+            raise UserError(_("Only draft batches can be calculated."))
         
-        if not calculations:
+        if not self.env['commission.calculation'].search_count(self._get_calculation_domain(), limit=1):
             raise UserError(_("No commission calculations found for the selected period."))
         
-        # Assign calculations to this batch
-        calculations.write({'batch_id': self.id})
-        
-        self.write({'state': 'calculated'})
-        
-        self.message_post(
-            body=_("Batch calculated with %d commission calculations.") % len(calculations)
-        )
-        
-        return {
-            'type': 'ir.actions.client',
-            'tag': 'display_notification',
-            'params': {
-                'title': _('Batch Calculated'),
-                'message': _('%d commission calculations have been added to this batch.') % len(calculations),
-                'type': 'success',
-                'sticky': False,
-            }
-        }
+        return self._start_job('calculating')
 
     def action_review(self):
         """Mark batch as reviewed by sales"""
@@ -275,29 +447,7 @@ class CommissionBatch(models.Model):
         if not self.payment_date:
             raise UserError(_("Please set a payment date before generating the payment document."))
         
-        # Create payment document
-        payment_doc = self.env['commission.payment.document'].create({
-            'batch_id': self.id,
-            'payment_date': self.payment_date,
-            'company_id': self.company_id.id,
-        })
-        
-        # Generate payment lines
-        payment_doc._generate_payment_lines()
-        
-        self.write({
-            'state': 'payment_generated',
-            'payment_document_id': payment_doc.id
-        })
-        
-        # Open the payment document
-        return {
-            'type': 'ir.actions.act_window',
-            'res_model': 'commission.payment.document',
-            'res_id': payment_doc.id,
-            'view_mode': 'form',
-            'target': 'current',
-        }
+        return self._start_job('generating')
 
     def action_mark_paid(self):
         """Mark batch as paid"""
@@ -306,20 +456,7 @@ class CommissionBatch(models.Model):
         if self.state != 'payment_generated':
             raise UserError(_("Only batches with payment documents can be marked as paid."))
         
-        # Mark all calculations as paid
-        self.calculation_ids.filtered(
-            lambda c: c.state == 'approved'
-        ).action_mark_paid()
-        
-        # Mark payment document as paid
-        if self.payment_document_id:
-            self.payment_document_id.state = 'paid'
-        
-        self.write({'state': 'paid'})
-        
-        self.message_post(
-            body=_("Batch marked as paid")
-        )
+        return self._start_job('paying')
 
     def action_reset_draft(self):
         """Reset batch to draft state"""
@@ -328,18 +465,250 @@ class CommissionBatch(models.Model):
         if self.state == 'paid':
             raise UserError(_("Cannot reset paid batches to draft."))
         
-        # Remove calculations from batch
-        self.calculation_ids.write({'batch_id': False})
+        if self.state in BATCH_JOBS:
+            raise UserError(_("This batch is already being processed."))
+        
+        return self._start_job('resetting')
+
+    def _start_job(self, state):
+        """Move the batch to a transient state and queue its processing
+        
+        Args:
+            state: transient state, key of BATCH_JOBS
+        
+        Returns:
+            dict: client action notifying the user
+        """
+        self.write({
+            'state': state,
+            'job_user_id': self.env.user.id,
+            'job_date_start': False,
+            'job_done': 0,
+            'job_total': 0,
+            'job_error': False,
+        })
+        self.env.ref('commission_band.ir_cron_process_commission_batches')._trigger()
+        return self._get_job_queued_action()
+
+    def action_retry_job(self):
+        """Queue again a batch whose background processing failed"""
+        self.ensure_one()
+        
+        if self.state not in BATCH_JOBS or not self.job_error:
+            raise UserError(_("Only batches whose processing failed can be retried."))
+        
+        self.write({
+            'job_user_id': self.env.user.id,
+            'job_error': False,
+        })
+        self.env.ref('commission_band.ir_cron_process_commission_batches')._trigger()
+        return self._get_job_queued_action()
+
+    def _get_job_queued_action(self):
+        """Client action telling the user the batch is processed in background"""
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Batch Queued'),
+                'message': _('The batch is processed in background, you will be notified when it is done.'),
+                'type': 'info',
+                'sticky': False,
+                'next': {'type': 'ir.actions.client', 'tag': 'soft_reload'},
+            }
+        }
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Cron worker processing the batches waiting in a transient state
+        
+        A cron job never runs twice at the same time, so a batch is only
+        processed by one worker. Progress is committed after each chunk.
+        Failed batches wait for action_retry_job.
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        chunk_size = int(self.env['ir.config_parameter'].sudo().get_param(
+            BATCH_JOB_CHUNK_SIZE_PARAM, DEFAULT_BATCH_JOB_CHUNK_SIZE
+        ))
+        
+        processed_ids = []
+        while True:
+            batch = self.search([
+                ('state', 'in', list(BATCH_JOBS)),
+                ('job_error', '=', False),
+                ('id', 'not in', processed_ids),
+            ], order='id', limit=1)
+            if not batch:
+                break
+            processed_ids.append(batch.id)
+            batch._run_job(chunk_size, auto_commit)
+        return True
+
+    def _run_job(self, chunk_size, auto_commit):
+        """Process the operation of a batch in a transient state
+        
+        The operation runs with the rights of the user who launched it and
+        commits after each chunk. Every operation only looks at what is left
+        to do, so when it fails the batch keeps its transient state with the
+        error, and a retry continues from where it stopped. The failure is
+        reported in the chatter and to the user who launched it.
+        
+        Args:
+            chunk_size: number of calculations processed per chunk
+            auto_commit: whether to commit after each chunk
+        """
+        self.ensure_one()
+        method, done_state = BATCH_JOBS[self.state]
+        self.write({
+            'job_date_start': fields.Datetime.now(),
+            'job_done': 0,
+            'job_total': 0,
+        })
+        
+        def progress(done, total):
+            self.write({'job_done': done, 'job_total': total})
+            if auto_commit:
+                self.env.cr.commit()
+            self.env.invalidate_all()
+        
+        batch = self.with_user(self.job_user_id or self.env.user).with_company(self.company_id)
+        try:
+            if auto_commit:
+                message = getattr(batch, method)(chunk_size, progress)
+            else:
+                with self.env.cr.savepoint():
+                    message = getattr(batch, method)(chunk_size, progress)
+        except Exception as e:
+            if auto_commit:
+                self.env.cr.rollback()
+            _logger.exception("Error processing commission batch %s", self.id)
+            # Chunks committed before the failure changed the calculations
+            self._recompute_statistics()
+            self.write({'job_error': str(e)})
+            self.message_post(body=_("Batch processing failed, it can be retried: %s", e))
+            self._notify_job_user(_('Batch Processing Failed'), _("%(batch)s: %(error)s", batch=self.name, error=e), 'danger')
+        else:
+            self.write({'state': done_state, 'job_error': False})
+            self.message_post(body=message)
+            self._notify_job_user(_('Batch Processed'), _("%(batch)s: %(message)s", batch=self.name, message=message), 'success')
+        if auto_commit:
+            self.env.cr.commit()
+
+    def _notify_job_user(self, title, message, notification_type):
+        """Send a notification to the user who launched the processing"""
+        if self.job_user_id:
+            self.job_user_id._bus_send('simple_notification', {
+                'type': notification_type,
+                'title': title,
+                'message': message,
+            })
+
+    def _job_calculate(self, chunk_size, progress):
+        """Assign the calculations of the period to this batch
+        
+        Calculations are assigned with one UPDATE per chunk: an ORM write
+        would track and apply statistic deltas record by record. The
+        statistics are recomputed once at the end. The calculations are
+        searched with the rights of the current user, so the UPDATE only
+        touches calculations the user can read.
+        
+        Returns:
+            str: chatter summary
+        """
+        Calculation = self.env['commission.calculation']
+        Calculation.flush_model()
+        calculation_ids = Calculation.search(self._get_calculation_domain(), order='id').ids
+        
+        assigned = 0
+        for start in range(0, len(calculation_ids), chunk_size):
+            chunk = calculation_ids[start:start + chunk_size]
+            assigned += len(self.env.execute_query(SQL("""
+                UPDATE commission_calculation
+                   SET batch_id = %s,
+                       in_batch = TRUE,
+                       write_uid = %s,
+                       write_date = now() at time zone 'UTC'
+                 WHERE id = ANY(%s)
+                   AND batch_id IS NULL
+             RETURNING id
+            """, self.id, self.env.uid, chunk)))
+            Calculation.invalidate_model(['batch_id', 'in_batch', 'write_uid', 'write_date'])
+            progress(start + len(chunk), len(calculation_ids))
+        
+        self.invalidate_recordset(['calculation_ids'])
+        self._recompute_statistics()
+        return _("Batch calculated with %(count)d commission calculations for %(salespeople)d salespeople.",
+                 count=assigned, salespeople=self.salesperson_count)
+
+    def _job_generate_payment_document(self, chunk_size, progress):
+        """Generate the payment document of this batch
+        
+        Runs in a single transaction; a document left by an earlier attempt
+        is reused.
+        
+        Returns:
+            str: chatter summary
+        """
+        payment_doc = self.payment_document_id
+        if not payment_doc:
+            payment_doc = self.env['commission.payment.document'].create({
+                'batch_id': self.id,
+                'payment_date': self.payment_date,
+                'company_id': self.company_id.id,
+            })
+            self.payment_document_id = payment_doc
+        if not payment_doc.line_ids:
+            payment_doc._generate_payment_lines()
+        progress(1, 1)
+        return _("Payment document %s generated.", payment_doc.name)
+
+    def _job_mark_paid(self, chunk_size, progress):
+        """Mark the approved calculations and the payment document as paid
+        
+        Only calculations still approved are processed, so a retry skips
+        the chunks already marked as paid.
+        
+        Returns:
+            str: chatter summary
+        """
+        Calculation = self.env['commission.calculation']
+        calculation_ids = Calculation.search([
+            ('batch_id', '=', self.id),
+            ('state', '=', 'approved'),
+        ], order='id').ids
+        for start in range(0, len(calculation_ids), chunk_size):
+            chunk = calculation_ids[start:start + chunk_size]
+            Calculation.browse(chunk).action_mark_paid()
+            progress(start + len(chunk), len(calculation_ids))
+        
+        if self.payment_document_id:
+            self.payment_document_id.state = 'paid'
+        return _("Batch marked as paid")
+
+    def _job_reset_draft(self, chunk_size, progress):
+        """Remove the calculations from this batch and drop its payment document
+        
+        Only calculations still in the batch are processed, so a retry skips
+        the chunks already removed.
+        
+        Returns:
+            str: chatter summary
+        """
+        Calculation = self.env['commission.calculation']
+        calculation_ids = Calculation.search([('batch_id', '=', self.id)], order='id').ids
+        for start in range(0, len(calculation_ids), chunk_size):
+            chunk = calculation_ids[start:start + chunk_size]
+            Calculation.browse(chunk).write({'batch_id': False})
+            progress(start + len(chunk), len(calculation_ids))
         
-        # Delete payment document if exists
         if self.payment_document_id:
             self.payment_document_id.unlink()
         
         self.write({
-            'state': 'draft',
             'reviewed_by_id': False,
             'reviewed_date': False
         })
+        return _("Batch reset to draft")
 
     def action_view_calculations(self):
         """View commission calculations in this batch"""
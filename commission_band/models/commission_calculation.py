@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _
+from odoo.tools import SQL, str2bool
 from odoo.exceptions import UserError, ValidationError
+from psycopg2 import errors as pgerrors
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# System parameter enabling the calculation counter table
+CALCULATION_COUNTER_PARAM = 'commission_band.calculation_counter'
+
+# Fields whose change alters the statistics of the calculation's batch
+BATCH_STAT_FIELDS = {'batch_id', 'state', 'commission_amount', 'currency_id', 'salesperson_id'}
+
 
 class CommissionCalculation(models.Model):
     _name = 'commission.calculation'
@@ -41,11 +49,13 @@ class CommissionCalculation(models.Model):
     rule_id = fields.Many2one(
         'commission.rule',
         string='Applied Rule',
+        index=True,
         tracking=True
     )
     band_id = fields.Many2one(
         'commission.band',
         string='Applied Band',
+        index=True,
         tracking=True
     )
     range_id = fields.Many2one(
@@ -59,6 +69,14 @@ class CommissionCalculation(models.Model):
         index=True,
         help="Batch this calculation belongs to"
     )
+    payment_line_id = fields.Many2one(
+        'commission.payment.line',
+        string='Payment Line',
+        index=True,
+        readonly=True,
+        copy=False,
+        help="Payment document line paying this calculation"
+    )
     
     # Date fields
     invoice_date = fields.Date(
@@ -213,6 +231,216 @@ class CommissionCalculation(models.Model):
         help="Indicates if this calculation is included in a batch"
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        calculations = super().create(vals_list)
+        self._invalidate_calculation_counts()
+        Batch = self.env['commission.batch']
+        Batch._apply_calculation_contributions({}, Batch._get_calculation_contributions(calculations))
+        return calculations
+
+    def write(self, vals):
+        Batch = self.env['commission.batch']
+        batch_fields = BATCH_STAT_FIELDS.intersection(vals)
+        if batch_fields:
+            before = Batch._get_calculation_contributions(self)
+        res = super().write(vals)
+        if 'rule_id' in vals or 'band_id' in vals:
+            self._invalidate_calculation_counts()
+        if batch_fields:
+            Batch._apply_calculation_contributions(before, Batch._get_calculation_contributions(self))
+        return res
+
+    def unlink(self):
+        Batch = self.env['commission.batch']
+        before = Batch._get_calculation_contributions(self)
+        res = super().unlink()
+        self._invalidate_calculation_counts()
+        Batch._apply_calculation_contributions(before, {})
+        return res
+
+    def init(self):
+        # One active calculation per payment/invoice pair, enforced by the
+        # database so concurrent calculations cannot create duplicates
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS commission_calculation_payment_invoice_uniq
+                        ON commission_calculation (payment_id, invoice_id)
+                     WHERE state != 'cancelled'
+                """)
+        except pgerrors.UniqueViolation:
+            _logger.warning("Duplicate active commission calculations found, "
+                            "cannot create index commission_calculation_payment_invoice_uniq")
+        
+        # Optional counter cache of the rule and band calculation counts: an
+        # append-only table of grouped deltas, so concurrent writers never
+        # lock a shared row. Replaces the triggers that updated the counters
+        # in the commission_rule and commission_band rows
+        self.env.cr.execute("""
+            DROP TRIGGER IF EXISTS commission_calculation_count_insert ON commission_calculation;
+            DROP TRIGGER IF EXISTS commission_calculation_count_delete ON commission_calculation;
+            DROP TRIGGER IF EXISTS commission_calculation_count_update ON commission_calculation;
+            DROP FUNCTION IF EXISTS commission_calculation_count_change();
+            DROP FUNCTION IF EXISTS commission_calculation_count_move();
+            
+            CREATE TABLE IF NOT EXISTS commission_calculation_counter (
+                rule_id integer,
+                band_id integer,
+                delta integer NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS commission_calculation_counter_rule_id_idx
+                ON commission_calculation_counter (rule_id) WHERE rule_id IS NOT NULL;
+            CREATE INDEX IF NOT EXISTS commission_calculation_counter_band_id_idx
+                ON commission_calculation_counter (band_id) WHERE band_id IS NOT NULL;
+            
+            CREATE OR REPLACE FUNCTION commission_calculation_counter_delta() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    INSERT INTO commission_calculation_counter (rule_id, band_id, delta)
+                    SELECT rule_id, band_id, COUNT(*) FROM new_rows
+                     WHERE rule_id IS NOT NULL OR band_id IS NOT NULL
+                  GROUP BY rule_id, band_id;
+                ELSIF TG_OP = 'DELETE' THEN
+                    INSERT INTO commission_calculation_counter (rule_id, band_id, delta)
+                    SELECT rule_id, band_id, -COUNT(*) FROM old_rows
+                     WHERE rule_id IS NOT NULL OR band_id IS NOT NULL
+                  GROUP BY rule_id, band_id;
+                ELSE
+                    -- Only the rows moved to another rule or band count
+                    INSERT INTO commission_calculation_counter (rule_id, band_id, delta)
+                    SELECT rule_id, band_id, SUM(delta)
+                      FROM (SELECT n.rule_id, n.band_id, 1 AS delta
+                              FROM new_rows n JOIN old_rows o ON o.id = n.id
+                             WHERE (n.rule_id, n.band_id) IS DISTINCT FROM (o.rule_id, o.band_id)
+                             UNION ALL
+                            SELECT o.rule_id, o.band_id, -1
+                              FROM new_rows n JOIN old_rows o ON o.id = n.id
+                             WHERE (n.rule_id, n.band_id) IS DISTINCT FROM (o.rule_id, o.band_id)) m
+                     WHERE rule_id IS NOT NULL OR band_id IS NOT NULL
+                  GROUP BY rule_id, band_id
+                    HAVING SUM(delta) != 0;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+        self._setup_calculation_counter()
+
+    @api.model
+    def _setup_calculation_counter(self):
+        """Enable or disable the calculation counter table
+        
+        Follows the commission_band.calculation_counter system parameter.
+        When enabled, the counter is reset from an exact count and statement
+        level triggers append the deltas of every insert, delete and move to
+        another rule or band. When disabled, counts are grouped queries on
+        the indexed rule_id and band_id columns.
+        """
+        enabled = str2bool(self.env['ir.config_parameter'].sudo().get_param(CALCULATION_COUNTER_PARAM, 'False'))
+        self.env.cr.execute("""
+            DROP TRIGGER IF EXISTS commission_calculation_counter_insert ON commission_calculation;
+            DROP TRIGGER IF EXISTS commission_calculation_counter_delete ON commission_calculation;
+            DROP TRIGGER IF EXISTS commission_calculation_counter_update ON commission_calculation;
+            DELETE FROM commission_calculation_counter;
+        """)
+        if enabled:
+            self.flush_model(['rule_id', 'band_id'])
+            self.env.cr.execute("""
+                CREATE TRIGGER commission_calculation_counter_insert
+                    AFTER INSERT ON commission_calculation
+                    REFERENCING NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION commission_calculation_counter_delta();
+                CREATE TRIGGER commission_calculation_counter_delete
+                    AFTER DELETE ON commission_calculation
+                    REFERENCING OLD TABLE AS old_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION commission_calculation_counter_delta();
+                CREATE TRIGGER commission_calculation_counter_update
+                    AFTER UPDATE ON commission_calculation
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION commission_calculation_counter_delta();
+                
+                INSERT INTO commission_calculation_counter (rule_id, band_id, delta)
+                SELECT rule_id, band_id, COUNT(*) FROM commission_calculation
+                 WHERE rule_id IS NOT NULL OR band_id IS NOT NULL
+              GROUP BY rule_id, band_id;
+            """)
+        self.env.registry.clear_cache()
+        self._invalidate_calculation_counts()
+
+    @api.model
+    @tools.ormcache()
+    def _is_calculation_counter_enabled(self):
+        """Whether the counter triggers are installed"""
+        self.env.cr.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'commission_calculation_counter_insert'")
+        return bool(self.env.cr.rowcount)
+
+    @api.model
+    def _get_calculation_counts(self, field_name, ids):
+        """Count the calculations of some rules or bands
+        
+        Args:
+            field_name: 'rule_id' or 'band_id'
+            ids: IDs of the commission.rule or commission.band records
+        
+        Returns:
+            dict: {record ID: number of calculations}
+        """
+        if not ids:
+            return {}
+        if not self._is_calculation_counter_enabled():
+            return {
+                record.id: count
+                for record, count in self._read_group([(field_name, 'in', ids)], [field_name], ['__count'])
+            }
+        self.flush_model([field_name])
+        rows = self.env.execute_query(SQL("""
+            SELECT %(column)s, SUM(delta)
+              FROM commission_calculation_counter
+             WHERE %(column)s = ANY(%(ids)s)
+          GROUP BY %(column)s
+        """, column=SQL.identifier(field_name), ids=list(ids)))
+        return dict(rows)
+
+    @api.model
+    def _get_calculation_count_subquery(self, field_name, alias):
+        """Correlated subquery counting the calculations of the rules or bands of alias"""
+        if self._is_calculation_counter_enabled():
+            return SQL(
+                "(SELECT COALESCE(SUM(delta), 0) FROM commission_calculation_counter WHERE %s = %s)",
+                SQL.identifier(field_name), SQL.identifier(alias, 'id'),
+            )
+        return SQL(
+            "(SELECT COUNT(*) FROM commission_calculation WHERE %s = %s)",
+            SQL.identifier(field_name), SQL.identifier(alias, 'id'),
+        )
+
+    @api.model
+    def _invalidate_calculation_counts(self):
+        """Drop the cached rule and band counts, which calculation changes alter"""
+        self.env['commission.rule'].invalidate_model(['calculation_count'])
+        self.env['commission.band'].invalidate_model(['calculation_count'])
+
+    @api.model
+    def _cron_fold_calculation_counter(self):
+        """Fold the deltas of the counter table into one row per rule and band
+        
+        Deltas appended by concurrent transactions are not visible to the
+        fold, so they are neither deleted nor lost.
+        """
+        if not self._is_calculation_counter_enabled():
+            return
+        self.env.cr.execute("""
+            WITH folded AS (
+                DELETE FROM commission_calculation_counter
+                  RETURNING rule_id, band_id, delta
+            )
+            INSERT INTO commission_calculation_counter (rule_id, band_id, delta)
+            SELECT rule_id, band_id, SUM(delta) FROM folded
+          GROUP BY rule_id, band_id
+            HAVING SUM(delta) != 0
+        """)
+
     @api.depends('salesperson_id', 'invoice_id', 'commission_amount', 'currency_id')
     def _compute_display_name(self):
         for calc in self:
@@ -255,12 +483,20 @@ class CommissionCalculation(models.Model):
 
     @api.depends('payment_date', 'currency_id', 'company_currency_id')
     def _compute_exchange_rate(self):
+        dated = self.filtered(lambda c: c.currency_id and c.company_currency_id and c.payment_date)
+        dated_ids = set(dated._ids)
+        if dated:
+            rate_table = self.env['res.currency']._get_commission_rate_table(
+                dated.currency_id.ids + dated.company_currency_id.ids,
+                dated.company_id,
+                min(dated.mapped('payment_date'))
+            )
         for calc in self:
-            if calc.currency_id and calc.company_currency_id and calc.payment_date:
-                calc.exchange_rate = calc.currency_id._get_conversion_rate(
-                    calc.currency_id,
-                    calc.company_currency_id,
-                    calc.company_id,
+            if calc.id in dated_ids:
+                calc.exchange_rate = rate_table.get_conversion_rate(
+                    calc.currency_id.id,
+                    calc.company_currency_id.id,
+                    calc.company_id.id,
                     calc.payment_date
                 )
             else:
@@ -315,10 +551,9 @@ class CommissionCalculation(models.Model):
                 raise UserError(_("Cannot validate commission for unreconciled payment."))
             
             # Check if salesperson configuration allows commission
-            config = self.env['salesperson.config'].search([
-                ('user_id', '=', calc.salesperson_id.id),
-                ('company_id', '=', calc.company_id.id)
-            ], limit=1)
+            config = self.env['salesperson.config']._get_config_values(
+                calc.salesperson_id.id, calc.company_id.id
+            )
             
             if config and not config.commission_active:
                 raise UserError(_("Commission is not active for salesperson %s") % calc.salesperson_id.name)
@@ -365,6 +600,8 @@ class CommissionCalculation(models.Model):
         for calc in self:
             if calc.batch_id and calc.batch_id.state in ['payment_generated', 'paid']:
                 raise UserError(_("Cannot remove calculation from a batch that has a payment document generated or is paid."))
+            if calc.batch_id and calc.batch_id.state in ['calculating', 'generating', 'paying', 'resetting']:
+                raise UserError(_("Cannot remove calculation from a batch that is being processed."))
             calc.batch_id = False
         
         return {
@@ -386,70 +623,128 @@ class CommissionCalculation(models.Model):
         Args:
             payment_id: ID of the account.payment record
         """
-        payment = self.env['account.payment'].browse(payment_id)
+        return self._calculate_commission_from_payments([payment_id])
+
+    @api.model
+    def _calculate_commission_from_payments(self, payment_ids):
+        """Calculate commissions for a set of payments in a single pass
         
-        # Skip if payment is not reconciled
-        if not payment.is_reconciled:
-            _logger.info("Payment %s is not reconciled. Skipping commission calculation.", payment.name)
-            return
+        Reconciled invoices and existing calculations are read once for the
+        whole set, salesperson configurations and rules come from registry
+        caches, and every new calculation is created with one multi-record
+        create().
         
-        # Process each reconciled invoice
-        for invoice in payment.reconciled_invoice_ids:
-            # Skip if no salesperson assigned
-            if not invoice.invoice_user_id:
-                _logger.info("Invoice %s has no salesperson. Skipping commission calculation.", invoice.name)
-                continue
-            
-            salesperson = invoice.invoice_user_id
-            
-            # Check if salesperson has commission active
-            config = self.env['salesperson.config'].search([
-                ('user_id', '=', salesperson.id),
-                ('company_id', '=', invoice.company_id.id)
-            ], limit=1)
-            
-            if config and not config.commission_active:
-                _logger.info("Commission not active for salesperson %s. Skipping.", salesperson.name)
-                continue
-            
-            # Check if commission already calculated for this payment-invoice combination
-            existing = self.search([
-                ('payment_id', '=', payment.id),
-                ('invoice_id', '=', invoice.id),
-                ('state', '!=', 'cancelled')
-            ], limit=1)
-            
-            if existing:
-                _logger.info("Commission already calculated for payment %s and invoice %s.", 
-                           payment.name, invoice.name)
-                continue
-            
-            # Find applicable rule
-            applicable_rule = salesperson.get_applicable_commission_rule(invoice, payment)
-            
-            if not applicable_rule and config and config.default_rule_id:
-                applicable_rule = config.default_rule_id
-            
-            if not applicable_rule:
-                _logger.info("No applicable commission rule found for salesperson %s.", salesperson.name)
-                continue
+        Args:
+            payment_ids: list of account.payment IDs
             
-            # Calculate commission
-            commission_data = applicable_rule.calculate_commission(payment, invoice, salesperson)
+        Returns:
+            commission.calculation recordset with the created calculations
+        """
+        payments = self.env['account.payment'].browse(payment_ids)
+        
+        # Skip payments that are not reconciled
+        for payment in payments.filtered(lambda p: not p.is_reconciled):
+            _logger.info("Payment %s is not reconciled. Skipping commission calculation.", payment.name)
+        payments = payments.filtered('is_reconciled')
+        if not payments:
+            return self.browse()
+        
+        # Reconciled invoices are computed for the whole set on first access,
+        # calculations are usually prefetched by the caller. Races are handled
+        # by the unique index in _create_skip_duplicates
+        Config = self.env['salesperson.config']
+        existing_pairs = {
+            (calc.payment_id.id, calc.invoice_id.id)
+            for calc in payments.commission_calculation_ids
+            if calc.state != 'cancelled'
+        }
+        
+        vals_list = []
+        for payment in payments:
+            for invoice in payment.reconciled_invoice_ids:
+                # Skip if no salesperson assigned
+                if not invoice.invoice_user_id:
+                    _logger.info("Invoice %s has no salesperson. Skipping commission calculation.", invoice.name)
+                    continue
+                
+                salesperson = invoice.invoice_user_id
+                
+                # Check if salesperson has commission active
+                config = Config._get_config_values(salesperson.id, invoice.company_id.id)
+                if config and not config.commission_active:
+                    _logger.info("Commission not active for salesperson %s. Skipping.", salesperson.name)
+                    continue
+                
+                # Check if commission already calculated for this payment-invoice combination
+                if (payment.id, invoice.id) in existing_pairs:
+                    _logger.info("Commission already calculated for payment %s and invoice %s.", 
+                               payment.name, invoice.name)
+                    continue
+                
+                # Find applicable rule
+                applicable_rule = salesperson.get_applicable_commission_rule(invoice, payment)
+                
+                if not applicable_rule and config and config.default_rule_id:
+                    applicable_rule = self.env['commission.rule'].browse(config.default_rule_id)
+                
+                if not applicable_rule:
+                    _logger.info("No applicable commission rule found for salesperson %s.", salesperson.name)
+                    continue
+                
+                # Calculate commission
+                commission_data = applicable_rule.calculate_commission(payment, invoice, salesperson)
+                
+                if commission_data:
+                    vals_list.append({
+                        'payment_id': payment.id,
+                        'invoice_id': invoice.id,
+                        'salesperson_id': salesperson.id,
+                        'rule_id': applicable_rule.id,
+                        'currency_id': payment.currency_id.id,
+                        'state': 'calculated',
+                        **commission_data
+                    })
+                    existing_pairs.add((payment.id, invoice.id))
+        
+        # Create all commission calculation records at once
+        calculations = self._create_skip_duplicates(vals_list)
+        _logger.info("Commission calculated for %d payment-invoice pairs out of %d payments.",
+                     len(calculations), len(payments))
+        return calculations
+
+    @api.model
+    def _create_skip_duplicates(self, vals_list):
+        """Create calculations with INSERT ... ON CONFLICT DO NOTHING semantics
+        
+        All records are created with one multi-record create(). If another
+        transaction already created an active calculation for one of the
+        payment/invoice pairs, the records are created one by one and the
+        duplicates are skipped.
+        
+        Args:
+            vals_list: list of value dicts for create()
             
-            if commission_data:
-                # Create commission calculation record
-                self.create({
-                    'payment_id': payment.id,
-                    'invoice_id': invoice.id,
-                    'salesperson_id': salesperson.id,
-                    'rule_id': applicable_rule.id,
-                    'currency_id': payment.currency_id.id,
-                    'state': 'calculated',
-                    **commission_data
-                })
-                _logger.info("Commission calculated for payment %s, invoice %s, salesperson %s.", 
-                           payment.name, invoice.name, salesperson.name)
+        Returns:
+            commission.calculation recordset with the created calculations
+        """
+        try:
+            with self.env.cr.savepoint():
+                return self.create(vals_list)
+        except pgerrors.UniqueViolation as e:
+            if e.diag.constraint_name != 'commission_calculation_payment_invoice_uniq':
+                raise
+        
+        calculations = self.browse()
+        for vals in vals_list:
+            try:
+                with self.env.cr.savepoint():
+                    calculations |= self.create(vals)
+            except pgerrors.UniqueViolation as e:
+                if e.diag.constraint_name != 'commission_calculation_payment_invoice_uniq':
+                    raise
+                _logger.info("Commission already calculated for payment %s and invoice %s.",
+                             vals['payment_id'], vals['invoice_id'])
+        return calculations
 
     @api.model
     def cron_validate_commissions(self):
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+JOB_BATCH_SIZE_PARAM = 'commission_band.job_batch_size'
+JOB_MAX_ATTEMPTS_PARAM = 'commission_band.job_max_attempts'
+DEFAULT_JOB_BATCH_SIZE = 200
+DEFAULT_JOB_MAX_ATTEMPTS = 5
+# Days a finished job is kept before being garbage collected
+JOB_RETENTION_DAYS = 7
+
+
+class CommissionJob(models.Model):
+    _name = 'commission.job'
+    _description = 'Commission Calculation Job'
+    _order = 'id desc'
+    _rec_name = 'payment_id'
+    
+    payment_id = fields.Many2one(
+        'account.payment',
+        string='Payment',
+        required=True,
+        ondelete='cascade',
+        readonly=True
+    )
+    company_id = fields.Many2one(
+        'res.company',
+        string='Company',
+        readonly=True,
+        index=True
+    )
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('waiting', 'Waiting for Reconciliation'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    ], string='State', default='pending', required=True, readonly=True, index=True)
+    attempt_count = fields.Integer(
+        string='Attempts',
+        readonly=True,
+        help="Number of times the worker tried to process this job"
+    )
+    error_message = fields.Text(
+        string='Last Error',
+        readonly=True
+    )
+    date_done = fields.Datetime(
+        string='Done On',
+        readonly=True
+    )
+    
+    _sql_constraints = [
+        ('payment_uniq', 'unique(payment_id)',
+         'Only one commission job per payment is allowed!'),
+    ]
+
+    @api.model
+    def _enqueue(self, payment_ids):
+        """Queue commission calculation for the given payments
+        
+        Only inserts job rows, so it is cheap enough to be called while
+        posting or reconciling payments. A payment already queued is not
+        duplicated; a finished, failed or waiting job for it is re-armed.
+        
+        Args:
+            payment_ids: list of account.payment IDs
+        """
+        if not payment_ids:
+            return
+        
+        self.env.cr.execute("""
+            INSERT INTO commission_job (payment_id, company_id, state, attempt_count,
+                                        create_uid, create_date, write_uid, write_date)
+                 SELECT p.id, p.company_id, 'pending', 0,
+                        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+                   FROM account_payment p
+                  WHERE p.id = ANY(%(payment_ids)s)
+            ON CONFLICT (payment_id) DO UPDATE
+                    SET state = 'pending',
+                        attempt_count = 0,
+                        error_message = NULL,
+                        date_done = NULL,
+                        write_uid = EXCLUDED.write_uid,
+                        write_date = EXCLUDED.write_date
+                  WHERE commission_job.state != 'pending'
+        """, {'uid': self.env.uid, 'payment_ids': list(payment_ids)})
+        self.invalidate_model()
+        
+        self.env.ref('commission_band.ir_cron_process_commission_jobs')._trigger()
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Cron worker draining the commission job queue
+        
+        Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+        workers can run at the same time without processing a job twice.
+        Each claimed batch is committed before the next one is claimed.
+        """
+        IrConfig = self.env['ir.config_parameter'].sudo()
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        batch_size = int(IrConfig.get_param(JOB_BATCH_SIZE_PARAM, DEFAULT_JOB_BATCH_SIZE))
+        max_attempts = int(IrConfig.get_param(JOB_MAX_ATTEMPTS_PARAM, DEFAULT_JOB_MAX_ATTEMPTS))
+        
+        last_id = 0
+        while True:
+            self.env.cr.execute("""
+                SELECT id, payment_id
+                  FROM commission_job
+                 WHERE state = 'pending'
+                   AND id > %s
+              ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+            """, [last_id, batch_size])
+            rows = self.env.cr.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            
+            errors = self._process_job_batch(dict(rows))
+            self._mark_jobs_processed([job_id for job_id, _payment_id in rows], errors, max_attempts)
+            
+            if auto_commit:
+                self.env.cr.commit()
+        
+        # Garbage collect old finished jobs
+        self.env.cr.execute("""
+            DELETE FROM commission_job
+             WHERE state = 'done'
+               AND date_done < (now() at time zone 'UTC') - interval '1 day' * %s
+        """, [JOB_RETENTION_DAYS])
+        return True
+
+    @api.model
+    def _process_job_batch(self, payment_by_job):
+        """Calculate commissions for a batch of claimed jobs
+        
+        Args:
+            payment_by_job: dict {job_id: payment_id}
+        
+        Returns:
+            dict: {job_id: error message} for the jobs that failed
+        """
+        Payment = self.env['account.payment']
+        try:
+            with self.env.cr.savepoint():
+                Payment.browse(list(payment_by_job.values()))._trigger_commission_calculation()
+            return {}
+        except Exception as e:
+            _logger.error("Error processing commission jobs in bulk, retrying per job: %s", str(e))
+        
+        errors = {}
+        for job_id, payment_id in payment_by_job.items():
+            try:
+                with self.env.cr.savepoint():
+                    Payment.browse(payment_id)._trigger_commission_calculation()
+            except Exception as e:
+                _logger.error("Error processing commission job %s for payment %s: %s", job_id, payment_id, str(e))
+                errors[job_id] = str(e)
+        return errors
+
+    @api.model
+    def _mark_jobs_processed(self, job_ids, errors, max_attempts):
+        """Record the outcome of processed jobs
+        
+        Jobs of payments that are not reconciled yet had nothing to calculate:
+        they wait for the reconciliation, which queues them again, instead of
+        being marked as done.
+        """
+        done_ids = [job_id for job_id in job_ids if job_id not in errors]
+        if done_ids:
+            self.env['account.payment'].flush_model(['is_reconciled'])
+            self.env.cr.execute("""
+                UPDATE commission_job j
+                   SET state = CASE WHEN p.is_reconciled THEN 'done' ELSE 'waiting' END,
+                       attempt_count = j.attempt_count + 1,
+                       error_message = NULL,
+                       date_done = CASE WHEN p.is_reconciled THEN now() at time zone 'UTC' END,
+                       write_date = now() at time zone 'UTC'
+                  FROM account_payment p
+                 WHERE p.id = j.payment_id
+                   AND j.id = ANY(%s)
+            """, [done_ids])
+        for job_id, error in errors.items():
+            self.env.cr.execute("""
+                UPDATE commission_job
+                   SET attempt_count = attempt_count + 1,
+                       error_message = %s,
+                       state = CASE WHEN attempt_count + 1 >= %s THEN 'failed' ELSE 'pending' END,
+                       write_date = now() at time zone 'UTC'
+                 WHERE id = %s
+            """, [error, max_attempts, job_id])
+        self.invalidate_model()
+
+    def action_retry(self):
+        """Put failed jobs back in the queue"""
+        self._enqueue(self.filtered(lambda j: j.state != 'pending').payment_id.ids)
@@ -132,95 +132,98 @@ class CommissionPaymentDocument(models.Model):
             doc.total_ves_payment = sum(doc.line_ids.mapped('amount_ves_payment'))
 
     def _generate_payment_lines(self):
-        """Generate payment lines from batch calculations"""
+        """Generate payment lines from batch calculations
+        
+        Calculations are summed per salesperson and currency by the
+        database, all the lines are created at once and the calculations are
+        linked to their line and approved with a single UPDATE.
+        """
         self.ensure_one()
         
         if self.line_ids:
             raise UserError(_("Payment lines already generated for this document."))
         
-        # Get exchange rate for payment date
-        usd = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-        ves = self.env['res.currency'].search([('name', '=', 'VES')], limit=1)
-        
-        if usd and ves:
-            self.exchange_rate_usd_ves = usd._get_conversion_rate(
-                usd, ves, self.company_id, self.payment_date
-            )
+        Calculation = self.env['commission.calculation']
+        usd_id, ves_id = self.company_id._get_commission_currency_ids()
         
-        # Group calculations by salesperson
-        salesperson_data = {}
-        
-        for calc in self.batch_id.calculation_ids.filtered(
-            lambda c: c.state in ['calculated', 'validated', 'approved']
-        ):
-            sp_id = calc.salesperson_id.id
-            if sp_id not in salesperson_data:
-                salesperson_data[sp_id] = {
-                    'salesperson_id': sp_id,
-                    'calculations': self.env['commission.calculation'],
-                    'total_usd': 0.0,
-                    'total_ves': 0.0,
-                    'total_other': {}  # For other currencies
-                }
-            
-            salesperson_data[sp_id]['calculations'] |= calc
-            
-            # Sum by currency
-            if calc.currency_id.name == 'USD':
-                salesperson_data[sp_id]['total_usd'] += calc.commission_amount
-            elif calc.currency_id.name == 'VES':
-                salesperson_data[sp_id]['total_ves'] += calc.commission_amount
-            else:
-                currency_name = calc.currency_id.name
-                if currency_name not in salesperson_data[sp_id]['total_other']:
-                    salesperson_data[sp_id]['total_other'][currency_name] = {
-                        'currency_id': calc.currency_id,
-                        'amount': 0.0
-                    }
-                salesperson_data[sp_id]['total_other'][currency_name]['amount'] += calc.commission_amount
+        # Sum the batch calculations per salesperson and currency in one query
+        groups = Calculation._read_group(
+            [('batch_id', '=', self.batch_id.id), ('state', 'in', ['calculated', 'validated', 'approved'])],
+            ['salesperson_id', 'currency_id'],
+            ['commission_amount:sum', '__count'],
+        )
         
-        # Create payment lines
-        PaymentLine = self.env['commission.payment.line']
+        rate_table = self.env['res.currency']._get_commission_rate_table(
+            [usd_id, ves_id] + [currency.id for _salesperson, currency, *_values in groups],
+            self.company_id,
+            self.payment_date
+        )
+        if usd_id and ves_id:
+            self.exchange_rate_usd_ves = rate_table.get_conversion_rate(
+                usd_id, ves_id, self.company_id.id, self.payment_date
+            )
         
-        for sp_id, data in salesperson_data.items():
-            # Create main line for salesperson
-            line_vals = {
+        line_vals_by_salesperson = {}
+        for salesperson, currency, amount, count in groups:
+            line_vals = line_vals_by_salesperson.setdefault(salesperson.id, {
                 'document_id': self.id,
-                'salesperson_id': sp_id,
-                'calculation_ids': [(6, 0, data['calculations'].ids)],
-                'commission_count': len(data['calculations']),
-            }
-            
-            # Calculate payment amounts
-            # USD commissions stay in USD
-            line_vals['amount_usd_original'] = data['total_usd']
-            line_vals['amount_usd_payment'] = data['total_usd']
+                'salesperson_id': salesperson.id,
+                'commission_count': 0,
+                'amount_usd_original': 0.0,
+                'amount_usd_payment': 0.0,
+                'amount_ves_original': 0.0,
+                'amount_ves_payment': 0.0,
+            })
+            line_vals['commission_count'] += count
             
-            # VES commissions stay in VES
-            line_vals['amount_ves_original'] = data['total_ves']
-            line_vals['amount_ves_payment'] = data['total_ves']
-            
-            # Convert other currencies to payment currency (usually VES)
-            # This is where you'd implement the logic for other currencies
-            # For now, we'll convert them to VES
-            total_other_in_ves = 0.0
-            for currency_data in data['total_other'].values():
-                amount_ves = currency_data['currency_id']._convert(
-                    currency_data['amount'],
-                    ves,
-                    self.company_id,
-                    self.payment_date
+            # USD and VES commissions are paid in their currency, other
+            # currencies are converted to VES, or to USD if there is no VES
+            if currency.id == usd_id:
+                line_vals['amount_usd_original'] += amount
+                line_vals['amount_usd_payment'] += amount
+            elif currency.id == ves_id:
+                line_vals['amount_ves_original'] += amount
+                line_vals['amount_ves_payment'] += amount
+            elif ves_id:
+                line_vals['amount_ves_payment'] += rate_table.convert(
+                    amount, currency.id, ves_id, self.company_id.id, self.payment_date
                 )
-                total_other_in_ves += amount_ves
-            
-            line_vals['amount_ves_payment'] += total_other_in_ves
-            
-            PaymentLine.create(line_vals)
+            elif usd_id:
+                line_vals['amount_usd_payment'] += rate_table.convert(
+                    amount, currency.id, usd_id, self.company_id.id, self.payment_date
+                )
+            else:
+                raise UserError(_(
+                    "Commissions in %(currency)s cannot be paid: the company has no active commission currency.",
+                    currency=currency.name,
+                ))
         
-        # Update calculations state
-        self.batch_id.calculation_ids.filtered(
-            lambda c: c.state in ['calculated', 'validated']
-        ).write({'state': 'approved'})
+        lines = self.env['commission.payment.line'].create(list(line_vals_by_salesperson.values()))
+        lines.flush_recordset()
+        Calculation.flush_model(['batch_id', 'salesperson_id', 'state'])
+        # Link and approve the calculations in the same UPDATE. The self join
+        # returns the state each calculation had before
+        self.env.cr.execute("""
+            UPDATE commission_calculation c
+               SET payment_line_id = l.id,
+                   state = 'approved',
+                   write_uid = %s,
+                   write_date = NOW() AT TIME ZONE 'UTC'
+              FROM commission_payment_line l, commission_calculation previous
+             WHERE l.document_id = %s
+               AND previous.id = c.id
+               AND c.batch_id = %s
+               AND c.salesperson_id = l.salesperson_id
+               AND c.state IN ('calculated', 'validated', 'approved')
+         RETURNING previous.state
+        """, [self.env.uid, self.id, self.batch_id.id])
+        approved_count = sum(1 for (state,) in self.env.cr.fetchall() if state != 'approved')
+        Calculation.invalidate_model(['payment_line_id', 'state', 'write_uid', 'write_date'])
+        lines.invalidate_recordset(['calculation_ids'])
+        
+        # One summary message instead of the tracking of each calculation
+        if approved_count:
+            self.message_post(body=_("%s commission calculations approved.", approved_count))
 
     def action_confirm(self):
         """Confirm payment document"""
@@ -241,11 +244,15 @@ class CommissionPaymentDocument(models.Model):
         if self.state != 'confirmed':
             raise UserError(_("Only confirmed documents can be marked as paid."))
         
-        self.write({'state': 'paid'})
+        if self.batch_id.state in ['calculating', 'generating', 'paying', 'resetting']:
+            raise UserError(_("The batch of this document is being processed."))
         
-        # Update batch state
+        # The batch is marked as paid in background, and marks this document
+        # as paid once all its calculations are
         if self.batch_id.state == 'payment_generated':
-            self.batch_id.action_mark_paid()
+            return self.batch_id.action_mark_paid()
+        
+        self.write({'state': 'paid'})
 
     def action_export_excel(self):
         """Export payment document to Excel"""
@@ -304,11 +311,9 @@ class CommissionPaymentLine(models.Model):
         string='Salesperson',
         required=True
     )
-    calculation_ids = fields.Many2many(
+    calculation_ids = fields.One2many(
         'commission.calculation',
-        'commission_payment_line_calc_rel',
-        'line_id',
-        'calc_id',
+        'payment_line_id',
         string='Commission Calculations'
     )
     
@@ -363,20 +368,29 @@ class CommissionPaymentLine(models.Model):
     @api.depends('amount_usd_payment', 'amount_ves_payment')
     def _compute_total_payment(self):
         """Compute total payment in company currency"""
+        currency_ids = self.company_id.currency_id.ids
+        for company in self.company_id:
+            currency_ids += list(company._get_commission_currency_ids())
+        rate_table = self.env['res.currency']._get_commission_rate_table(
+            currency_ids,
+            self.company_id,
+            min(filter(None, self.document_id.mapped('payment_date')), default=None)
+        )
         for line in self:
             # Get company currency
-            company_currency = line.company_id.currency_id
+            company_currency_id = line.company_id.currency_id.id
+            usd_id, ves_id = line.company_id._get_commission_currency_ids()
             
             total = 0.0
             
             # Convert USD to company currency
             if line.amount_usd_payment > 0:
-                usd = self.env['res.currency'].search([('name', '=', 'USD')], limit=1)
-                if usd and usd != company_currency:
-                    total += usd._convert(
+                if usd_id and usd_id != company_currency_id:
+                    total += rate_table.convert(
                         line.amount_usd_payment,
-                        company_currency,
-                        line.company_id,
+                        usd_id,
+                        company_currency_id,
+                        line.company_id.id,
                         line.document_id.payment_date
                     )
                 else:
@@ -384,12 +398,12 @@ class CommissionPaymentLine(models.Model):
             
             # Convert VES to company currency
             if line.amount_ves_payment > 0:
-                ves = self.env['res.currency'].search([('name', '=', 'VES')], limit=1)
-                if ves and ves != company_currency:
-                    total += ves._convert(
+                if ves_id and ves_id != company_currency_id:
+                    total += rate_table.convert(
                         line.amount_ves_payment,
-                        company_currency,
-                        line.company_id,
+                        ves_id,
+                        company_currency_id,
+                        line.company_id.id,
                         line.document_id.payment_date
                     )
                 else:
@@ -405,7 +419,7 @@ class CommissionPaymentLine(models.Model):
             'type': 'ir.actions.act_window',
             'res_model': 'commission.calculation',
             'view_mode': 'list,form',
-            'domain': [('id', 'in', self.calculation_ids.ids)],
+            'domain': [('payment_line_id', '=', self.id)],
             'context': {
                 'create': False,
                 'delete': False,
@@ -80,6 +80,38 @@ class CommissionRange(models.Model):
         string='Color Index',
         compute='_compute_color'
     )
+    
+    _sql_constraints = [
+        # Checked by the database before the exclusion constraint, which
+        # cannot build an inverted range
+        ('day_check', 'CHECK (day_from <= day_to)',
+         "'Days From' must be less than or equal to 'Days To'!"),
+        # Also covers concurrent writes. int4range(band_id, band_id) turns the
+        # band equality into a range overlap, so the constraint needs no
+        # btree_gist extension. It is deferrable so that commission.band.write
+        # can check it on the final state of the ranges
+        ('day_range_excl', "EXCLUDE USING gist ("
+                           "int4range(band_id, band_id, '[]') WITH &&, "
+                           "int4range(day_from, day_to, '[]') WITH &&) "
+                           "DEFERRABLE INITIALLY IMMEDIATE",
+         'Day ranges cannot overlap within the same commission band!'),
+    ]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        ranges = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return ranges
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
 
     @api.depends('day_from', 'day_to', 'name', 'commission_rate')
     def _compute_display_name(self):
@@ -110,15 +142,6 @@ class CommissionRange(models.Model):
             else:                                      # Rojo si < 0.75%
                 range_rec.color = 1   # Red
 
-    @api.constrains('day_from', 'day_to')
-    def _check_day_range(self):
-        """Ensure day_from <= day_to"""
-        for range_rec in self:
-            if range_rec.day_from > range_rec.day_to:
-                raise ValidationError(_(
-                    "'Days From' (%s) must be less than or equal to 'Days To' (%s)"
-                ) % (range_rec.day_from, range_rec.day_to))
-
     @api.constrains('commission_rate')
     def _check_commission_rate(self):
         """Ensure commission rate is not negative"""
@@ -1,7 +1,26 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import SQL
+from collections import namedtuple
+
+# Criteria compiled into inverted maps by _get_rule_index:
+# (index key, rule Many2many field)
+RULE_INDEX_DIMENSIONS = (
+    ('salesperson', 'salesperson_ids'),
+    ('team', 'team_ids'),
+    ('customer', 'customer_ids'),
+    ('journal', 'journal_ids'),
+    ('payment_term', 'payment_term_ids'),
+)
+
+# Compiled rule set of one company
+#   entries: tuple of (rule_id, date_from, date_to, min_amount, max_amount,
+#            product_ids, category_ids) in evaluation order
+#   inverted: {dimension: {criterion_id: frozenset(rule_ids)}}
+#   wildcard: {dimension: frozenset(rule_ids)} rules without that criterion
+RuleIndex = namedtuple('RuleIndex', ['entries', 'inverted', 'wildcard'])
 
 
 class CommissionRule(models.Model):
@@ -160,11 +179,12 @@ class CommissionRule(models.Model):
         help="Apply only to payments from these journals"
     )
     
-    # Statistics - Made searchable with store=True
+    # Statistics - Searchable through a grouped count on commission_calculation
+    # (see commission.calculation._get_calculation_counts)
     calculation_count = fields.Integer(
         string='Number of Calculations',
         compute='_compute_calculation_count',
-        store=True
+        search='_search_calculation_count'
     )
     
     _sql_constraints = [
@@ -172,6 +192,22 @@ class CommissionRule(models.Model):
          'The code must be unique per company!'),
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        rules = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return rules
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
     @api.constrains('commission_type', 'band_id', 'fixed_amount', 'percentage_rate')
     def _check_commission_config(self):
         """Ensure commission configuration is complete"""
@@ -199,10 +235,20 @@ class CommissionRule(models.Model):
 
     def _compute_calculation_count(self):
         """Compute the number of calculations using this rule"""
+        counts = self.env['commission.calculation']._get_calculation_counts('rule_id', self._origin.ids)
         for rule in self:
-            rule.calculation_count = self.env['commission.calculation'].search_count([
-                ('rule_id', '=', rule.id)
-            ])
+            rule.calculation_count = counts.get(rule._origin.id, 0)
+
+    def _search_calculation_count(self, operator, value):
+        if operator not in ('=', '!=', '<', '<=', '>', '>='):
+            raise UserError(_("Operation not supported"))
+        query = self._search([])
+        query.add_where(SQL(
+            "%s %s %s",
+            self.env['commission.calculation']._get_calculation_count_subquery('rule_id', query.table),
+            SQL(operator), value or 0
+        ))
+        return [('id', 'in', query)]
 
     @api.onchange('commission_type')
     def _onchange_commission_type(self):
@@ -292,6 +338,122 @@ class CommissionRule(models.Model):
         
         return True
 
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_rule_index(self, company_id):
+        """Compile the active rules of a company into an in-memory index
+        
+        The index is cached at registry level and invalidated whenever a
+        commission rule is created, written or unlinked.
+        
+        Args:
+            company_id: ID of the res.company
+            
+        Returns:
+            RuleIndex: compiled rules of the company
+        """
+        rules = self.sudo().search([
+            ('active', '=', True),
+            ('company_id', '=', company_id)
+        ], order='priority, sequence, id')
+        
+        entries = []
+        inverted = {dimension: {} for dimension, _fname in RULE_INDEX_DIMENSIONS}
+        wildcard = {dimension: set() for dimension, _fname in RULE_INDEX_DIMENSIONS}
+        for rule in rules:
+            entries.append((
+                rule.id,
+                rule.date_from,
+                rule.date_to,
+                rule.min_amount,
+                rule.max_amount,
+                frozenset(rule.product_ids.ids),
+                frozenset(rule.category_ids.ids),
+            ))
+            for dimension, fname in RULE_INDEX_DIMENSIONS:
+                criterion_ids = rule[fname].ids
+                if not criterion_ids:
+                    wildcard[dimension].add(rule.id)
+                for criterion_id in criterion_ids:
+                    inverted[dimension].setdefault(criterion_id, set()).add(rule.id)
+        
+        return RuleIndex(
+            entries=tuple(entries),
+            inverted={
+                dimension: {key: frozenset(ids) for key, ids in mapping.items()}
+                for dimension, mapping in inverted.items()
+            },
+            wildcard={dimension: frozenset(ids) for dimension, ids in wildcard.items()},
+        )
+
+    @api.model
+    def _find_applicable_rule(self, company, invoice=None, payment=None, salesperson=None):
+        """Find the first rule of a company matching the given criteria
+        
+        Equivalent to evaluating matches_criteria on every active rule in
+        priority order, but resolved through the compiled rule index with a
+        few set intersections instead of reading Many2many fields per rule.
+        
+        Args:
+            company: res.company record
+            invoice: account.move record (optional)
+            payment: account.payment record (optional)
+            salesperson: res.users record (optional)
+            
+        Returns:
+            commission.rule record or empty recordset
+        """
+        index = self._get_rule_index(company.id)
+        if not index.entries:
+            return self.browse()
+        
+        # Criteria that apply for the given records, as in matches_criteria
+        keys = {}
+        if salesperson:
+            keys['salesperson'] = salesperson.id
+            if salesperson.sale_team_id:
+                keys['team'] = salesperson.sale_team_id.id
+        if invoice:
+            keys['customer'] = invoice.partner_id.id
+            keys['payment_term'] = invoice.invoice_payment_term_id.id
+        if payment:
+            keys['journal'] = payment.journal_id.id
+        
+        candidates = None
+        for dimension, key in keys.items():
+            matching = index.inverted[dimension].get(key, frozenset()) | index.wildcard[dimension]
+            candidates = matching if candidates is None else candidates & matching
+            if not candidates:
+                return self.browse()
+        
+        check_date = payment.date if payment else fields.Date.today()
+        amount = payment.amount if payment else 0
+        product_ids = category_ids = None
+        
+        for rule_id, date_from, date_to, min_amount, max_amount, rule_product_ids, rule_category_ids in index.entries:
+            if candidates is not None and rule_id not in candidates:
+                continue
+            if date_from and check_date < date_from:
+                continue
+            if date_to and check_date > date_to:
+                continue
+            if min_amount and amount < min_amount:
+                continue
+            if max_amount and amount > max_amount:
+                continue
+            if (rule_product_ids or rule_category_ids) and invoice:
+                if product_ids is None:
+                    products = invoice.invoice_line_ids.mapped('product_id')
+                    product_ids = set(products.ids)
+                    category_ids = set(products.mapped('categ_id').ids)
+                if rule_product_ids and rule_product_ids.isdisjoint(product_ids):
+                    continue
+                if rule_category_ids and rule_category_ids.isdisjoint(category_ids):
+                    continue
+            return self.browse(rule_id)
+        
+        return self.browse()
+
     def calculate_commission(self, payment, invoice, salesperson):
         """Calculate commission based on rule configuration
         
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from odoo.tools import SQL
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Key of a rollup row. Rows without band are keyed on band 0, as NULLs
+# never conflict in a unique index
+STAT_KEY_CONFLICT = "(company_id, salesperson_id, date, currency_id, state, (COALESCE(band_id, 0)))"
+
+# Rollup rows aggregated from a set of commission_calculation rows, with
+# their sign (+1 added, -1 removed). They are sorted on the conflict key,
+# so concurrent upserts lock the rollup rows in the same order and cannot
+# deadlock
+STAT_DELTA_SELECT = """
+    SELECT company_id, salesperson_id, payment_date, currency_id, state, band_id,
+           SUM(sign),
+           SUM(sign * COALESCE(commission_amount, 0)),
+           SUM(sign * COALESCE(commission_amount_company, 0)),
+           SUM(sign * COALESCE(days_overdue, 0)),
+           COALESCE(SUM(sign) FILTER (WHERE days_overdue != 0), 0),
+           clock_timestamp() AT TIME ZONE 'UTC'
+      FROM (%s) calc
+     WHERE payment_date IS NOT NULL
+  GROUP BY company_id, salesperson_id, payment_date, currency_id, state, band_id
+  ORDER BY company_id, salesperson_id, payment_date, currency_id, state, COALESCE(band_id, 0)
+"""
+
+# Columns of commission_calculation the rollup depends on
+STAT_SOURCE_COLUMNS = (
+    'company_id', 'salesperson_id', 'payment_date', 'currency_id', 'state', 'band_id',
+    'commission_amount', 'commission_amount_company', 'days_overdue',
+)
+
+# Apply a delta to the rollup and give the salespeople it touched a new
+# version. Returns the IDs of the rows left without calculations, which the
+# caller deletes
+STAT_UPSERT = """
+    WITH upserted AS (
+        INSERT INTO commission_stat_daily AS s (company_id, salesperson_id, date, currency_id, state, band_id,
+                                                calculation_count, commission_amount, commission_amount_company,
+                                                days_overdue_sum, overdue_count, last_update)
+        %s
+        ON CONFLICT %s DO UPDATE
+           SET calculation_count = s.calculation_count + EXCLUDED.calculation_count,
+               commission_amount = s.commission_amount + EXCLUDED.commission_amount,
+               commission_amount_company = s.commission_amount_company + EXCLUDED.commission_amount_company,
+               days_overdue_sum = s.days_overdue_sum + EXCLUDED.days_overdue_sum,
+               overdue_count = s.overdue_count + EXCLUDED.overdue_count,
+               last_update = EXCLUDED.last_update
+        RETURNING s.id, s.company_id, s.salesperson_id, s.calculation_count
+    ), bumped AS (
+        INSERT INTO commission_stat_version (company_id, salesperson_id, version)
+        SELECT company_id, salesperson_id, nextval('commission_stat_version_seq')
+          FROM (SELECT DISTINCT company_id, salesperson_id
+                  FROM upserted
+              ORDER BY company_id, salesperson_id) touched
+        ON CONFLICT (company_id, salesperson_id) DO UPDATE
+           SET version = EXCLUDED.version
+    )
+    SELECT array_agg(id) FILTER (WHERE calculation_count = 0) %s
+      FROM upserted
+"""
+
+
+def _changed_rows(alias, other, sign):
+    """Rows of a transition table whose rolled-up columns differ in the other one"""
+    return """
+        SELECT %(a)s.*, %(sign)s AS sign
+          FROM %(a)s
+          JOIN %(b)s ON %(b)s.id = %(a)s.id
+         WHERE (%(a_columns)s) IS DISTINCT FROM (%(b_columns)s)
+    """ % {
+        'a': alias,
+        'b': other,
+        'sign': sign,
+        'a_columns': ', '.join('%s.%s' % (alias, column) for column in STAT_SOURCE_COLUMNS),
+        'b_columns': ', '.join('%s.%s' % (other, column) for column in STAT_SOURCE_COLUMNS),
+    }
+
+
+class CommissionStatDaily(models.Model):
+    _name = 'commission.stat.daily'
+    _description = 'Daily Commission Statistics'
+    _order = 'date desc, salesperson_id'
+    _rec_name = 'date'
+    _log_access = False
+    
+    # Key
+    company_id = fields.Many2one(
+        'res.company',
+        string='Company',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    salesperson_id = fields.Many2one(
+        'res.users',
+        string='Salesperson',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    date = fields.Date(
+        string='Payment Date',
+        required=True,
+        readonly=True,
+        index=True
+    )
+    currency_id = fields.Many2one(
+        'res.currency',
+        string='Currency',
+        required=True,
+        readonly=True
+    )
+    state = fields.Selection(
+        selection='_get_state_selection',
+        string='State',
+        required=True,
+        readonly=True
+    )
+    band_id = fields.Many2one(
+        'commission.band',
+        string='Applied Band',
+        readonly=True
+    )
+    
+    # Measures
+    calculation_count = fields.Integer(
+        string='Calculations',
+        readonly=True
+    )
+    commission_amount = fields.Monetary(
+        string='Commission Amount',
+        currency_field='currency_id',
+        readonly=True
+    )
+    commission_amount_company = fields.Monetary(
+        string='Commission Amount (Company Currency)',
+        currency_field='company_currency_id',
+        readonly=True
+    )
+    days_overdue_sum = fields.Integer(
+        string='Total Days Overdue',
+        readonly=True
+    )
+    overdue_count = fields.Integer(
+        string='Calculations with Days Overdue',
+        readonly=True,
+        help="Calculations paid before or after their due date, used for average collection days"
+    )
+    last_update = fields.Datetime(
+        string='Last Updated',
+        readonly=True,
+        help="Last time a calculation change was applied to this row"
+    )
+    company_currency_id = fields.Many2one(
+        'res.currency',
+        related='company_id.currency_id',
+        readonly=True
+    )
+
+    @api.model
+    def _get_state_selection(self):
+        return self.env['commission.calculation']._fields['state'].selection
+
+    def init(self):
+        # The rollup is maintained by statement level triggers on
+        # commission_calculation, so any insert, update or delete (including
+        # cascades and raw SQL) applies its delta to the daily rows.
+        # commission_stat_version holds a version per salesperson and company,
+        # renewed in the same statement as their rows. Versions are taken from
+        # a sequence, which does not roll back: a version seen inside a
+        # transaction that is rolled back is never handed out again, so
+        # unlike the row count or the last update it is safe to key caches on
+        self.env.cr.execute("""
+            CREATE SEQUENCE IF NOT EXISTS commission_stat_version_seq;
+            CREATE TABLE IF NOT EXISTS commission_stat_version (
+                company_id integer NOT NULL,
+                salesperson_id integer NOT NULL,
+                version bigint NOT NULL DEFAULT 0,
+                PRIMARY KEY (company_id, salesperson_id)
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS commission_stat_daily_key_uniq
+                ON commission_stat_daily %s;
+            DROP INDEX IF EXISTS commission_stat_daily_empty_idx;
+        """ % STAT_KEY_CONFLICT)
+        # Rows emptied by a statement are deleted by ID. A column list
+        # (UPDATE OF) cannot be combined with transition tables, so the update
+        # trigger only aggregates the rows whose rolled-up columns changed:
+        # writes of e.g. batch_id or payment_line_id apply an empty delta
+        self.env.cr.execute("""
+            CREATE OR REPLACE FUNCTION commission_stat_daily_change() RETURNS trigger AS $$
+            DECLARE
+                delta_sign integer := TG_ARGV[0]::integer;
+                emptied integer[];
+            BEGIN
+                %s;
+                DELETE FROM commission_stat_daily WHERE id = ANY(emptied);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            CREATE OR REPLACE FUNCTION commission_stat_daily_move() RETURNS trigger AS $$
+            DECLARE
+                emptied integer[];
+            BEGIN
+                %s;
+                DELETE FROM commission_stat_daily WHERE id = ANY(emptied);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            
+            DROP TRIGGER IF EXISTS commission_stat_daily_insert ON commission_calculation;
+            CREATE TRIGGER commission_stat_daily_insert
+                AFTER INSERT ON commission_calculation
+                REFERENCING NEW TABLE AS changed_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION commission_stat_daily_change(1);
+            DROP TRIGGER IF EXISTS commission_stat_daily_delete ON commission_calculation;
+            CREATE TRIGGER commission_stat_daily_delete
+                AFTER DELETE ON commission_calculation
+                REFERENCING OLD TABLE AS changed_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION commission_stat_daily_change(-1);
+            DROP TRIGGER IF EXISTS commission_stat_daily_update ON commission_calculation;
+            CREATE TRIGGER commission_stat_daily_update
+                AFTER UPDATE ON commission_calculation
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION commission_stat_daily_move();
+        """ % (
+            STAT_UPSERT % (
+                STAT_DELTA_SELECT % ("SELECT *, delta_sign AS sign FROM changed_rows"),
+                STAT_KEY_CONFLICT,
+                "INTO emptied",
+            ),
+            STAT_UPSERT % (
+                STAT_DELTA_SELECT % (_changed_rows('new_rows', 'old_rows', 1)
+                                     + " UNION ALL " + _changed_rows('old_rows', 'new_rows', -1))
+                + " HAVING SUM(sign) != 0"
+                  " OR SUM(sign * COALESCE(commission_amount, 0)) != 0"
+                  " OR SUM(sign * COALESCE(commission_amount_company, 0)) != 0"
+                  " OR SUM(sign * COALESCE(days_overdue, 0)) != 0"
+                  " OR SUM(sign) FILTER (WHERE days_overdue != 0) != 0",
+                STAT_KEY_CONFLICT,
+                "INTO emptied",
+            ),
+        ))
+        
+        # Fill the rollup when installing over existing calculations
+        self.env.cr.execute("""
+            SELECT NOT EXISTS (SELECT 1 FROM commission_stat_daily)
+               AND EXISTS (SELECT 1 FROM commission_calculation)
+        """)
+        if self.env.cr.fetchone()[0]:
+            self._rebuild()
+
+    @api.model
+    def _rebuild(self):
+        """Rebuild the whole rollup from commission_calculation
+        
+        The rollup table is locked for the duration of the transaction, so
+        calculations changed concurrently apply their delta after the rebuild.
+        """
+        self.env['commission.calculation'].flush_model()
+        self.env.cr.execute("LOCK TABLE commission_stat_daily IN EXCLUSIVE MODE")
+        self.env.cr.execute("UPDATE commission_stat_version SET version = nextval('commission_stat_version_seq')")
+        self.env.cr.execute("DELETE FROM commission_stat_daily")
+        self.env.cr.execute(STAT_UPSERT % (
+            STAT_DELTA_SELECT % ("SELECT *, 1 AS sign FROM commission_calculation"),
+            STAT_KEY_CONFLICT,
+            "",
+        ))
+        self.invalidate_model()
+        _logger.info("Daily commission statistics rebuilt")
+
+    def action_rebuild(self):
+        """Repair the rollup, e.g. after restoring calculations from a backup"""
+        self.check_access('write')
+        self.sudo()._rebuild()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Statistics Rebuilt'),
+                'message': _('Daily commission statistics were recomputed from the calculations.'),
+                'type': 'success',
+                'next': {'type': 'ir.actions.client', 'tag': 'reload'},
+            }
+        }
+
+    @api.model
+    def _get_stats_stamp(self, salesperson_id, company_id):
+        """Version of the rollup rows of a salesperson
+        
+        Changes to a new value, never used before, whenever a calculation of
+        the salesperson is created, changed or deleted, so it can key caches
+        of figures derived from them.
+        
+        Returns:
+            int: version, 0 if the salesperson never had calculations
+        """
+        self.env['commission.calculation'].flush_model()
+        self.env.cr.execute("""
+            SELECT version
+              FROM commission_stat_version
+             WHERE salesperson_id = %s
+               AND company_id = %s
+        """, [salesperson_id, company_id])
+        row = self.env.cr.fetchone()
+        return row[0] if row else 0
+
+    @api.model
+    def _read_commission_stats(self, domain, groupby):
+        """Aggregate commission statistics from the daily rollup
+        
+        Args:
+            domain: search domain on commission.stat.daily
+            groupby: list of field names to group by
+        
+        Returns:
+            dict: {tuple of groupby values: (count, total in company currency,
+            average days overdue)}. The average ignores calculations with no
+            days overdue.
+        """
+        rows = self._read_group(domain, groupby, [
+            'calculation_count:sum', 'commission_amount_company:sum',
+            'days_overdue_sum:sum', 'overdue_count:sum',
+        ])
+        stats = {}
+        for row in rows:
+            keys = tuple(value.id if isinstance(value, models.BaseModel) else value for value in row[:len(groupby)])
+            count, total, days_sum, overdue_count = row[len(groupby):]
+            stats[keys] = (count, total, days_sum / overdue_count if overdue_count else 0.0)
+        return stats
+
+    @api.model
+    def _get_dashboard_domain(self, company, team=None, date_from=None, date_to=None):
+        """Domain of the rollup rows of a company or team dashboard
+        
+        Args:
+            company: res.company record
+            team: crm.team record (optional), restricts to its members
+            date_from: first payment date (optional)
+            date_to: last payment date (optional)
+        """
+        domain = [('company_id', '=', company.id)]
+        if team:
+            domain.append(('salesperson_id', 'in', team.member_ids.ids))
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        return domain
+
+    @api.model
+    def _get_dashboard_stamp(self, company, team=None):
+        """Version of the rollup rows of a company or team dashboard
+        
+        Digest of the versions of the salespeople involved. As versions are
+        never reused, a digest seen once never stands for other figures.
+        
+        Args:
+            company: res.company record
+            team: crm.team record (optional), restricts to its members
+        
+        Returns:
+            str: version, empty if there never were calculations
+        """
+        self.env['commission.calculation'].flush_model()
+        query = SQL("""
+            SELECT COALESCE(md5(string_agg(salesperson_id || ':' || version, ',' ORDER BY salesperson_id)), '')
+              FROM commission_stat_version
+             WHERE company_id = %s
+        """, company.id)
+        if team:
+            query = SQL("%s AND salesperson_id = ANY(%s)", query, team.member_ids.ids)
+        [(version,)] = self.env.execute_query(query)
+        return version
+
+    @api.model
+    def _get_dashboard_data(self, domain):
+        """Aggregate a team or company dashboard with a single grouped query
+        
+        Args:
+            domain: search domain on commission.stat.daily
+        
+        Returns:
+            dict: totals, per state, per salesperson and per month figures.
+            Totals, salespeople and months only cover validated, approved and
+            paid commissions.
+        """
+        rows = self._read_group(domain, ['salesperson_id', 'state', 'date:month'], [
+            'calculation_count:sum', 'commission_amount_company:sum',
+            'days_overdue_sum:sum', 'overdue_count:sum',
+        ])
+        
+        def _new_totals():
+            return {'count': 0, 'amount': 0.0, 'days_overdue_sum': 0, 'overdue_count': 0}
+        
+        totals = _new_totals()
+        states = {
+            state: {'label': label, 'count': 0, 'amount': 0.0}
+            for state, label in self._get_state_selection()
+        }
+        salespeople = {}
+        months = {}
+        for salesperson, state, month, count, amount, days_sum, overdue_count in rows:
+            states[state]['count'] += count
+            states[state]['amount'] += amount
+            if state not in ('validated', 'approved', 'paid'):
+                continue
+            for values in (
+                totals,
+                salespeople.setdefault(salesperson, _new_totals()),
+                months.setdefault(month, _new_totals()),
+            ):
+                values['count'] += count
+                values['amount'] += amount
+                values['days_overdue_sum'] += days_sum
+                values['overdue_count'] += overdue_count
+        
+        def _export(values):
+            return {
+                'count': values['count'],
+                'amount': values['amount'],
+                'avg_collection_days': (
+                    values['days_overdue_sum'] / values['overdue_count'] if values['overdue_count'] else 0.0
+                ),
+            }
+        
+        return {
+            'totals': _export(totals),
+            'states': states,
+            'salespeople': [
+                dict(_export(values), id=salesperson.id, name=salesperson.name)
+                for salesperson, values in sorted(salespeople.items(), key=lambda item: -item[1]['amount'])
+            ],
+            'monthly_trend': [
+                dict(_export(values), month=fields.Date.to_string(month))
+                for month, values in sorted(months.items())
+            ],
+        }
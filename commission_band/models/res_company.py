@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, tools
+
+# Currencies used when a company has no payout currency configured
+DEFAULT_PRIMARY_CURRENCY_CODE = 'USD'
+DEFAULT_SECONDARY_CURRENCY_CODE = 'VES'
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+    
+    commission_primary_currency_id = fields.Many2one(
+        'res.currency',
+        string='Primary Commission Currency',
+        help="Main payout currency of commissions (USD if not set). Batch totals of "
+             "commissions in other currencies are converted to this currency."
+    )
+    commission_secondary_currency_id = fields.Many2one(
+        'res.currency',
+        string='Secondary Commission Currency',
+        help="Local payout currency of commissions (VES if not set). Payment documents "
+             "convert commissions in other currencies to this currency."
+    )
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'commission_primary_currency_id', 'commission_secondary_currency_id'} & set(vals):
+            self.env.registry.clear_cache()
+        return res
+
+    @tools.ormcache('self.id')
+    def _get_commission_currency_ids(self):
+        """Get the commission payout currencies of the company
+        
+        Cached at registry level, so hot loops can compare currency IDs
+        instead of searching currencies or comparing names.
+        
+        Returns:
+            tuple: (primary currency ID, secondary currency ID), False when
+            the currency does not exist
+        """
+        self.ensure_one()
+        Currency = self.env['res.currency']
+        primary = self.sudo().commission_primary_currency_id
+        secondary = self.sudo().commission_secondary_currency_id
+        return (
+            primary.id or Currency._get_currency_id_by_code(DEFAULT_PRIMARY_CURRENCY_CODE),
+            secondary.id or Currency._get_currency_id_by_code(DEFAULT_SECONDARY_CURRENCY_CODE),
+        )
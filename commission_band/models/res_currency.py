@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+from odoo.tools import float_round
+from bisect import bisect_right
+
+
+class CommissionRateTable(object):
+    """Currency rates preloaded in memory for bulk commission conversions
+    
+    Rates are kept per (currency, company) as sorted parallel tuples of dates
+    and rates, and looked up with a binary search. The lookup follows
+    res.currency._get_rates: the company's own rates win over the shared
+    ones, the latest rate on or before the date is used, and the earliest
+    rate is the fallback when there is none before the date.
+    """
+
+    def __init__(self, rates, roots, roundings):
+        """
+        Args:
+            rates: {(currency_id, company_id or False): (dates, rates)}
+            roots: {company_id: root company ID}
+            roundings: {currency_id: rounding}
+        """
+        self._rates = rates
+        self._roots = roots
+        self._roundings = roundings
+
+    def _check_currency(self, currency_id):
+        """Raise if currency_id is not set or was not loaded in the table"""
+        if currency_id not in self._roundings:
+            raise UserError(_(
+                "Commission amounts cannot be converted: a commission currency is not configured "
+                "or not active. Check the commission currencies of the company."
+            ))
+
+    def _get_rate(self, currency_id, company_id, date):
+        keys = ((currency_id, self._roots.get(company_id, company_id)), (currency_id, False))
+        for key in keys:
+            dates, rates = self._rates.get(key, ((), ()))
+            idx = bisect_right(dates, date) - 1
+            if idx >= 0:
+                return rates[idx]
+        for key in keys:
+            dates, rates = self._rates.get(key, ((), ()))
+            if rates:
+                return rates[0]
+        return 1.0
+
+    def get_conversion_rate(self, from_currency_id, to_currency_id, company_id, date=None):
+        """Same as res.currency._get_conversion_rate, with IDs"""
+        if from_currency_id == to_currency_id:
+            return 1.0
+        self._check_currency(from_currency_id)
+        self._check_currency(to_currency_id)
+        date = date or fields.Date.today()
+        return self._get_rate(to_currency_id, company_id, date) / self._get_rate(from_currency_id, company_id, date)
+
+    def convert(self, amount, from_currency_id, to_currency_id, company_id, date=None, round=True):
+        """Same as res.currency._convert, with IDs
+        
+        Raises a UserError if a currency is not set or was not loaded, instead
+        of converting with a missing rate.
+        """
+        if from_currency_id == to_currency_id or not amount:
+            return amount
+        amount = amount * self.get_conversion_rate(from_currency_id, to_currency_id, company_id, date)
+        if round:
+            return float_round(amount, precision_rounding=self._roundings[to_currency_id])
+        return amount
+
+
+class ResCurrency(models.Model):
+    _inherit = 'res.currency'
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        currencies = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return currencies
+
+    def write(self, vals):
+        res = super().write(vals)
+        if {'name', 'active'} & set(vals):
+            self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache('code')
+    def _get_currency_id_by_code(self, code):
+        """Get the ID of the active currency with the given ISO code
+        
+        Args:
+            code: ISO 4217 code, e.g. 'USD'
+        
+        Returns:
+            int: currency ID, or False if there is no such active currency
+        """
+        return self.sudo().search([('name', '=', code)], limit=1).id
+
+    @api.model
+    def _get_commission_rate_table(self, currency_ids, companies, date_from=None):
+        """Load the rates needed for bulk commission conversions at once
+        
+        Args:
+            currency_ids: IDs of the currencies to convert from or to
+            companies: res.company records the conversions are made for
+            date_from: earliest conversion date (optional). Older rates are
+                not loaded, except the last one before that date.
+        
+        Returns:
+            CommissionRateTable
+        """
+        currency_ids = list(set(currency_ids) - {False, None})
+        roots = {company.id: company.root_id.id for company in companies}
+        
+        self.env['res.currency.rate'].flush_model(['name', 'rate', 'currency_id', 'company_id'])
+        self.env.cr.execute("""
+            SELECT r.currency_id, r.company_id, r.name, r.rate
+              FROM res_currency_rate r
+             WHERE r.currency_id = ANY(%(currency_ids)s)
+               AND (r.company_id IS NULL OR r.company_id = ANY(%(root_ids)s))
+               AND (%(date_from)s IS NULL OR r.name >= COALESCE((
+                    SELECT MAX(p.name)
+                      FROM res_currency_rate p
+                     WHERE p.currency_id = r.currency_id
+                       AND p.company_id IS NOT DISTINCT FROM r.company_id
+                       AND p.name <= %(date_from)s
+               ), r.name))
+          ORDER BY r.currency_id, r.company_id, r.name
+        """, {
+            'currency_ids': currency_ids,
+            'root_ids': list(set(roots.values())),
+            'date_from': date_from or None,
+        })
+        
+        grouped = {}
+        for currency_id, company_id, date, rate in self.env.cr.fetchall():
+            dates, rates = grouped.setdefault((currency_id, company_id or False), ([], []))
+            dates.append(date)
+            rates.append(rate)
+        
+        return CommissionRateTable(
+            rates={key: (tuple(dates), tuple(rates)) for key, (dates, rates) in grouped.items()},
+            roots=roots,
+            roundings={currency.id: currency.rounding for currency in self.browse(currency_ids)},
+        )
@@ -1,11 +1,24 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
+from odoo import models, fields, api, tools, _, _lt
+from odoo.tools import SQL
 from dateutil.relativedelta import relativedelta
+import copy
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Collection delay buckets of the dashboard: (key, label, upper bound in days)
+COLLECTION_RANGES = [
+    ('early', _lt('Early (< 0 days)'), -1),
+    ('ontime', _lt('On Time (0-15 days)'), 15),
+    ('minor', _lt('Minor Delay (16-30 days)'), 30),
+    ('moderate', _lt('Moderate Delay (31-60 days)'), 60),
+    ('major', _lt('Major Delay (61-120 days)'), 120),
+    ('critical', _lt('Critical Delay (> 120 days)'), None),
+]
+VALIDATED_STATES = ('validated', 'approved', 'paid')
+
 
 class ResUsers(models.Model):
     _inherit = 'res.users'
@@ -65,24 +78,19 @@ class ResUsers(models.Model):
     @api.depends('commission_config_ids')
     def _compute_commission_stats(self):
         """Compute commission statistics for the user"""
-        for user in self:
-            calculations = self.env['commission.calculation'].search([
-                ('salesperson_id', '=', user.id),
-                ('company_id', '=', user.company_id.id),
+        stats = {}
+        if self.ids:
+            stats = self.env['commission.stat.daily']._read_commission_stats([
+                ('salesperson_id', 'in', self.ids),
+                ('company_id', 'in', self.company_id.ids),
                 ('state', 'in', ['validated', 'approved', 'paid'])
-            ])
-            
-            user.commission_calculation_count = len(calculations)
-            
-            # Convert all amounts to company currency for summing
-            total = 0.0
-            for calc in calculations:
-                total += calc.commission_amount_company
+            ], ['salesperson_id', 'company_id'])
+        
+        for user in self:
+            count, total, avg_days = stats.get((user.id, user.company_id.id), (0, 0.0, 0.0))
+            user.commission_calculation_count = count
             user.total_commission_amount = total
-            
-            # Calculate average collection days
-            days_list = calculations.filtered('days_overdue').mapped('days_overdue')
-            user.avg_collection_days = sum(days_list) / len(days_list) if days_list else 0.0
+            user.avg_collection_days = avg_days
 
     def get_applicable_commission_rule(self, invoice=None, payment=None):
         """Get the applicable commission rule for this user
@@ -102,40 +110,25 @@ class ResUsers(models.Model):
             return False
         
         # Get current company config
-        config = self.commission_config_ids.filtered(
-            lambda c: c.company_id == (invoice.company_id if invoice else self.company_id)
-        )
+        company = invoice.company_id if invoice else self.company_id
+        config = self.env['salesperson.config']._get_config_values(self.id, company.id)
         
         if config and not config.commission_active:
             _logger.info("Commission not active in configuration for user %s", self.name)
             return False
         
-        # Search for applicable rules
-        domain = [
-            ('active', '=', True),
-            ('company_id', '=', invoice.company_id.id if invoice else self.company_id.id)
-        ]
-        
-        # Add date filter if payment exists
-        if payment:
-            domain.extend([
-                '|', ('date_from', '=', False), ('date_from', '<=', payment.date),
-                '|', ('date_to', '=', False), ('date_to', '>=', payment.date),
-            ])
-        
-        rules = self.env['commission.rule'].search(domain, order='priority, sequence')
-        
-        # Find first matching rule
-        for rule in rules:
-            if rule.matches_criteria(invoice, payment, self):
-                _logger.info("Found applicable rule %s for user %s", rule.name, self.name)
-                return rule
+        # Resolve the first matching rule through the compiled rule index
+        rule = self.env['commission.rule']._find_applicable_rule(company, invoice, payment, self)
+        if rule:
+            _logger.info("Found applicable rule %s for user %s", rule.name, self.name)
+            return rule
         
         # Check for default rule in config
-        if config and config.default_rule_id and config.default_rule_id.active:
-            if config.default_rule_id.matches_criteria(invoice, payment, self):
-                _logger.info("Using default rule %s for user %s", config.default_rule_id.name, self.name)
-                return config.default_rule_id
+        default_rule = self.env['commission.rule'].browse(config.default_rule_id if config else [])
+        if default_rule and default_rule.active:
+            if default_rule.matches_criteria(invoice, payment, self):
+                _logger.info("Using default rule %s for user %s", default_rule.name, self.name)
+                return default_rule
         
         _logger.info("No applicable commission rule found for user %s", self.name)
         return False
@@ -161,10 +154,7 @@ class ResUsers(models.Model):
         self.ensure_one()
         
         # Get or create config for current company
-        config = self.env['salesperson.config'].search([
-            ('user_id', '=', self.id),
-            ('company_id', '=', self.company_id.id)
-        ], limit=1)
+        config = self.env['salesperson.config']._get_config_values(self.id, self.company_id.id)
         
         if not config:
             config = self.env['salesperson.config'].create({
@@ -184,73 +174,105 @@ class ResUsers(models.Model):
     def get_commission_dashboard_data(self):
         """Get data for commission dashboard
         
+        Results are cached per user, company and day. The cache key includes
+        the version of the user's daily statistics, so any change to the
+        user's calculations makes the next call recompute.
+        
         Returns:
             dict: Dashboard data including calculations by state, monthly trends, etc.
         """
         self.ensure_one()
         
-        calculations = self.env['commission.calculation'].search([
+        company_id = self.company_id.id
+        stamp = self.env['commission.stat.daily']._get_stats_stamp(self.id, company_id)
+        return copy.deepcopy(self._get_commission_dashboard_values(
+            company_id, fields.Date.context_today(self), stamp
+        ))
+
+    @tools.ormcache('self.env.uid', 'self.env.lang', 'self.id', 'company_id', 'today', 'stamp')
+    def _get_commission_dashboard_values(self, company_id, today, stamp):
+        """Aggregate the dashboard data with two grouped queries
+        
+        States and monthly trend come from the daily statistics, collection
+        ranges from a CASE over the calculations' days overdue.
+        
+        Args:
+            company_id: company to report on
+            today: reference day of the monthly trend
+            stamp: version of the user's statistics, only part of the cache key
+        """
+        Calculation = self.env['commission.calculation']
+        
+        rows = self.env['commission.stat.daily']._read_group([
             ('salesperson_id', '=', self.id),
-            ('company_id', '=', self.company_id.id)
+            ('company_id', '=', company_id),
+        ], ['state', 'date:month'], [
+            'calculation_count:sum', 'commission_amount_company:sum',
+            'days_overdue_sum:sum', 'overdue_count:sum',
         ])
         
         # Group by state
         states_data = {}
-        for state, label in calculations._fields['state'].selection:
-            state_calcs = calculations.filtered(lambda c: c.state == state)
-            states_data[state] = {
-                'label': label,
-                'count': len(state_calcs),
-                'amount': sum(state_calcs.mapped('commission_amount_company'))
-            }
+        for state, label in Calculation._fields['state'].selection:
+            states_data[state] = {'label': label, 'count': 0, 'amount': 0.0}
         
         # Monthly trend (last 12 months)
-        monthly_data = []
-        for i in range(11, -1, -1):
-            month_start = fields.Date.today().replace(day=1) - relativedelta(months=i)
-            month_end = month_start + relativedelta(months=1, days=-1)
-            
-            month_calcs = calculations.filtered(
-                lambda c: month_start <= c.payment_date <= month_end and 
-                c.state in ['validated', 'approved', 'paid']
-            )
-            
-            monthly_data.append({
-                'month': month_start.strftime('%b %Y'),
-                'amount': sum(month_calcs.mapped('commission_amount_company')),
-                'count': len(month_calcs)
-            })
+        first_month = today.replace(day=1) - relativedelta(months=11)
+        monthly = {first_month + relativedelta(months=i): [0.0, 0] for i in range(12)}
+        
+        total_count = total_amount = days_sum = overdue_count = 0
+        for state, month, count, amount, state_days_sum, state_overdue_count in rows:
+            states_data[state]['count'] += count
+            states_data[state]['amount'] += amount
+            if state in VALIDATED_STATES:
+                total_count += count
+                total_amount += amount
+                days_sum += state_days_sum
+                overdue_count += state_overdue_count
+                if month in monthly:
+                    monthly[month][0] += amount
+                    monthly[month][1] += count
+        
+        monthly_data = [{
+            'month': month.strftime('%b %Y'),
+            'amount': amount,
+            'count': count,
+        } for month, (amount, count) in monthly.items()]
         
         # Collection efficiency by range
+        query = Calculation._search([
+            ('salesperson_id', '=', self.id),
+            ('company_id', '=', company_id),
+            ('state', 'in', VALIDATED_STATES),
+        ])
+        days_overdue = SQL("COALESCE(%s, 0)", Calculation._field_to_sql(query.table, 'days_overdue', query))
+        bucket = SQL("CASE %s ELSE %s END", SQL(" ").join(
+            SQL("WHEN %s <= %s THEN %s", days_overdue, bound, key)
+            for key, _label, bound in COLLECTION_RANGES if bound is not None
+        ), COLLECTION_RANGES[-1][0])
+        query.groupby = bucket
+        bucket_stats = {key: (count, amount) for key, count, amount in self.env.execute_query(query.select(
+            bucket,
+            SQL("COUNT(*)"),
+            SQL("COALESCE(SUM(%s), 0)", Calculation._field_to_sql(query.table, 'commission_amount_company', query)),
+        ))}
         range_data = []
-        ranges = [
-            ('early', _('Early (< 0 days)'), lambda d: d < 0),
-            ('ontime', _('On Time (0-15 days)'), lambda d: 0 <= d <= 15),
-            ('minor', _('Minor Delay (16-30 days)'), lambda d: 16 <= d <= 30),
-            ('moderate', _('Moderate Delay (31-60 days)'), lambda d: 31 <= d <= 60),
-            ('major', _('Major Delay (61-120 days)'), lambda d: 61 <= d <= 120),
-            ('critical', _('Critical Delay (> 120 days)'), lambda d: d > 120),
-        ]
-        
-        for key, label, condition in ranges:
-            range_calcs = calculations.filtered(
-                lambda c: c.state in ['validated', 'approved', 'paid'] and 
-                condition(c.days_overdue)
-            )
+        for key, label, _bound in COLLECTION_RANGES:
+            count, amount = bucket_stats.get(key, (0, 0.0))
             range_data.append({
                 'key': key,
-                'label': label,
-                'count': len(range_calcs),
-                'amount': sum(range_calcs.mapped('commission_amount_company'))
+                'label': str(label),
+                'count': count,
+                'amount': amount,
             })
         
         return {
             'states': states_data,
             'monthly_trend': monthly_data,
             'collection_ranges': range_data,
-            'total_commission': self.total_commission_amount,
-            'avg_collection_days': self.avg_collection_days,
-            'calculation_count': self.commission_calculation_count,
+            'total_commission': total_amount,
+            'avg_collection_days': days_sum / overdue_count if overdue_count else 0.0,
+            'calculation_count': total_count,
         }
 
     @api.model
@@ -264,10 +286,7 @@ class ResUsers(models.Model):
         created_count = 0
         for user in sales_users:
             for company in user.company_ids:
-                existing = self.env['salesperson.config'].search([
-                    ('user_id', '=', user.id),
-                    ('company_id', '=', company.id)
-                ], limit=1)
+                existing = self.env['salesperson.config']._get_config_values(user.id, company.id)
                 
                 if not existing:
                     self.env['salesperson.config'].create({
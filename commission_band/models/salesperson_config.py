@@ -1,7 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields, api, _
-from odoo.exceptions import ValidationError
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import SQL
+from collections import namedtuple
+
+# Immutable snapshot of a salesperson configuration, as cached by
+# salesperson.config._get_config_values (relational fields are IDs)
+SalespersonConfigValues = namedtuple('SalespersonConfigValues', [
+    'id', 'commission_active', 'default_rule_id', 'override_commission_type',
+    'override_percentage', 'override_fixed_amount', 'override_band_id',
+    'min_commission_amount', 'max_commission_amount',
+])
+
+# Statistics fields aggregated from commission.calculation
+COMMISSION_STAT_FIELDS = ('calculation_count', 'total_commission', 'avg_collection_days')
+COMMISSION_STAT_STATES = ('validated', 'approved', 'paid')
 
 
 class SalespersonConfig(models.Model):
@@ -90,16 +104,19 @@ class SalespersonConfig(models.Model):
     # Statistics
     calculation_count = fields.Integer(
         string='Number of Calculations',
-        compute='_compute_calculation_count'
+        compute='_compute_commission_stats',
+        search='_search_calculation_count'
     )
     total_commission = fields.Monetary(
         string='Total Commission',
-        compute='_compute_total_commission',
+        compute='_compute_commission_stats',
+        search='_search_total_commission',
         currency_field='currency_id'
     )
     avg_collection_days = fields.Float(
         string='Avg. Collection Days',
-        compute='_compute_avg_collection_days',
+        compute='_compute_commission_stats',
+        search='_search_avg_collection_days',
         help="Average days between invoice due date and payment"
     )
     
@@ -115,6 +132,22 @@ class SalespersonConfig(models.Model):
          'Only one configuration per salesperson per company is allowed!'),
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        configs = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return configs
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
     @api.depends('user_id', 'commission_active')
     def _compute_display_name(self):
         for config in self:
@@ -123,34 +156,101 @@ class SalespersonConfig(models.Model):
                 name += _(" (Inactive)")
             config.display_name = name
 
-    def _compute_calculation_count(self):
-        for config in self:
-            config.calculation_count = self.env['commission.calculation'].search_count([
-                ('salesperson_id', '=', config.user_id.id),
-                ('company_id', '=', config.company_id.id)
+    def _compute_commission_stats(self):
+        """Compute the statistics of all configs with one grouped query on the daily rollup"""
+        stats = {}
+        if self.ids:
+            query = self.env['commission.stat.daily']._search([
+                ('salesperson_id', 'in', self.user_id.ids),
+                ('company_id', 'in', self.company_id.ids)
             ])
-
-    def _compute_total_commission(self):
+            group_terms = [
+                SQL.identifier(query.table, 'salesperson_id'),
+                SQL.identifier(query.table, 'company_id'),
+            ]
+            aggregates = self._get_commission_stat_aggregates(query.table)
+            query.groupby = SQL(", ").join(group_terms)
+            rows = self.env.execute_query(query.select(
+                *group_terms,
+                *(aggregates[fname] for fname in COMMISSION_STAT_FIELDS)
+            ))
+            stats = {(row[0], row[1]): row[2:] for row in rows}
+        
         for config in self:
-            calculations = self.env['commission.calculation'].search([
-                ('salesperson_id', '=', config.user_id.id),
-                ('company_id', '=', config.company_id.id),
-                ('state', 'in', ['validated', 'approved', 'paid'])
-            ])
-            config.total_commission = sum(calculations.mapped('commission_amount'))
+            count, total, avg_days = stats.get((config.user_id.id, config.company_id.id), (0, 0.0, 0.0))
+            config.calculation_count = count
+            config.total_commission = total
+            config.avg_collection_days = avg_days
 
-    def _compute_avg_collection_days(self):
-        for config in self:
-            calculations = self.env['commission.calculation'].search([
-                ('salesperson_id', '=', config.user_id.id),
-                ('company_id', '=', config.company_id.id),
-                ('state', 'in', ['validated', 'approved', 'paid']),
-                ('days_overdue', '!=', False)
-            ])
-            if calculations:
-                config.avg_collection_days = sum(calculations.mapped('days_overdue')) / len(calculations)
-            else:
-                config.avg_collection_days = 0
+    @api.model
+    def _get_commission_stat_aggregates(self, alias):
+        """SQL aggregates of the statistics fields
+        
+        Args:
+            alias: alias of the commission_stat_daily table being aggregated
+        
+        Returns:
+            dict: {field name: SQL aggregate expression}
+        """
+        validated = SQL("%s IN %s", SQL.identifier(alias, 'state'), COMMISSION_STAT_STATES)
+        return {
+            'calculation_count': SQL("COALESCE(SUM(%s), 0)", SQL.identifier(alias, 'calculation_count')),
+            'total_commission': SQL(
+                "COALESCE(SUM(%s) FILTER (WHERE %s), 0)",
+                SQL.identifier(alias, 'commission_amount'), validated
+            ),
+            # Calculations paid on their due date count in the average, as
+            # days_overdue is stored as 0 rather than NULL for them
+            'avg_collection_days': SQL(
+                "COALESCE(SUM(%s) FILTER (WHERE %s)::float / NULLIF(SUM(%s) FILTER (WHERE %s), 0), 0)",
+                SQL.identifier(alias, 'days_overdue_sum'), validated,
+                SQL.identifier(alias, 'calculation_count'), validated
+            ),
+        }
+
+    @api.model
+    def _get_commission_stat_subquery(self, alias, field_name):
+        """Correlated subquery computing a statistics field for the configs of alias"""
+        query = self.env['commission.stat.daily']._search([])
+        query.add_where(SQL(
+            "%s = %s AND %s = %s",
+            SQL.identifier(query.table, 'salesperson_id'), SQL.identifier(alias, 'user_id'),
+            SQL.identifier(query.table, 'company_id'), SQL.identifier(alias, 'company_id'),
+        ))
+        return SQL("(%s)", query.subselect(self._get_commission_stat_aggregates(query.table)[field_name]))
+
+    def _search_commission_stat(self, field_name, operator, value):
+        if operator not in ('=', '!=', '<', '<=', '>', '>='):
+            raise UserError(_("Operation not supported"))
+        query = self._search([])
+        query.add_where(SQL(
+            "%s %s %s",
+            self._get_commission_stat_subquery(query.table, field_name), SQL(operator), value or 0
+        ))
+        return [('id', 'in', query)]
+
+    def _search_calculation_count(self, operator, value):
+        return self._search_commission_stat('calculation_count', operator, value)
+
+    def _search_total_commission(self, operator, value):
+        return self._search_commission_stat('total_commission', operator, value)
+
+    def _search_avg_collection_days(self, operator, value):
+        return self._search_commission_stat('avg_collection_days', operator, value)
+
+    def _order_field_to_sql(self, alias, field_name, direction, nulls, query):
+        # Statistics are not stored, sort on their aggregate instead
+        if field_name in COMMISSION_STAT_FIELDS:
+            return SQL("%s %s %s", self._get_commission_stat_subquery(alias, field_name), direction, nulls)
+        return super()._order_field_to_sql(alias, field_name, direction, nulls, query)
+
+    @api.model
+    def fields_get(self, allfields=None, attributes=None):
+        res = super().fields_get(allfields, attributes)
+        for field_name in COMMISSION_STAT_FIELDS:
+            if 'sortable' in res.get(field_name, {}):
+                res[field_name]['sortable'] = True
+        return res
 
     @api.constrains('override_commission_type', 'override_percentage', 'override_fixed_amount', 'override_band_id')
     def _check_override_config(self):
@@ -256,6 +356,41 @@ class SalespersonConfig(models.Model):
         
         return {'type': 'none'}
 
+    @api.model
+    @tools.ormcache('user_id', 'company_id')
+    def _get_config_values(self, user_id, company_id):
+        """Resolve the configuration of a salesperson in a company
+        
+        Cached at registry level and invalidated on any configuration
+        create, write or unlink.
+        
+        Args:
+            user_id: ID of the res.users
+            company_id: ID of the res.company
+            
+        Returns:
+            SalespersonConfigValues or None if the salesperson has no configuration
+        """
+        config = self.sudo().search([
+            ('user_id', '=', user_id),
+            ('company_id', '=', company_id)
+        ], limit=1)
+        
+        if not config:
+            return None
+        
+        return SalespersonConfigValues(
+            id=config.id,
+            commission_active=config.commission_active,
+            default_rule_id=config.default_rule_id.id,
+            override_commission_type=config.override_commission_type,
+            override_percentage=config.override_percentage,
+            override_fixed_amount=config.override_fixed_amount,
+            override_band_id=config.override_band_id.id,
+            min_commission_amount=config.min_commission_amount,
+            max_commission_amount=config.max_commission_amount,
+        )
+
     @api.model
     def create_or_update_config(self, user_id, company_id=None, vals=None):
         """Helper method to create or update salesperson configuration
@@ -271,10 +406,8 @@ class SalespersonConfig(models.Model):
         if not company_id:
             company_id = self.env.company.id
         
-        config = self.search([
-            ('user_id', '=', user_id),
-            ('company_id', '=', company_id)
-        ], limit=1)
+        config_values = self._get_config_values(user_id, company_id)
+        config = self.browse(config_values.id if config_values else [])
         
         if config:
             if vals:
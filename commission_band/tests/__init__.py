@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+from . import test_commission_band
+from . import test_commission_batch
+from . import test_commission_rule
+from . import test_commission_stat_daily
+from . import test_dashboard_controller
+from . import test_migrations
+from . import test_res_currency
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+from odoo import Command
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from odoo.addons.mail.tests.common import mail_new_test_user
+
+
+class CommissionBandCommon(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True))
+        cls.company = cls.company_data['company']
+        cls.bank_journal = cls.company_data['default_journal_bank']
+        
+        # Commission currencies: USD is the company currency, VES is paid apart
+        cls.currency_usd = cls.env.ref('base.USD')
+        cls.currency_ves = cls.env.ref('base.VES')
+        cls.currency_ves.active = True
+        cls.env['res.currency.rate'].create({
+            'name': '2024-01-01',
+            'rate': 36.0,
+            'currency_id': cls.currency_ves.id,
+            'company_id': cls.company.id,
+        })
+        cls.company.write({
+            'commission_primary_currency_id': cls.currency_usd.id,
+            'commission_secondary_currency_id': cls.currency_ves.id,
+        })
+        
+        cls.salesperson = mail_new_test_user(
+            cls.env,
+            login='commission_salesperson',
+            name='Commission Salesperson',
+            groups='base.group_user,sales_team.group_sale_salesman',
+            company_id=cls.company.id,
+        )
+        cls.other_salesperson = mail_new_test_user(
+            cls.env,
+            login='commission_other_salesperson',
+            name='Other Commission Salesperson',
+            groups='base.group_user,sales_team.group_sale_salesman',
+            company_id=cls.company.id,
+        )
+        
+        cls.band = cls.env['commission.band'].create({
+            'name': 'Test Band',
+            'code': 'TEST',
+            'company_id': cls.company.id,
+            'range_ids': [
+                Command.create({'name': 'Early', 'day_from': -9999, 'day_to': -1, 'commission_rate': 5.0}),
+                Command.create({'name': 'On Time', 'day_from': 0, 'day_to': 15, 'commission_rate': 4.0,
+                                'indicator_rate': 1.0}),
+                Command.create({'name': 'Late', 'day_from': 16, 'day_to': 60, 'commission_rate': 2.0,
+                                'min_payment_amount': 100.0}),
+                Command.create({'name': 'Late VES', 'day_from': 61, 'day_to': 120, 'commission_rate': 1.5,
+                                'apply_only_currency_id': cls.currency_ves.id}),
+                Command.create({'name': 'Very Late', 'day_from': 200, 'day_to': 9999, 'commission_rate': 0.5}),
+            ],
+        })
+
+    @classmethod
+    def _create_invoice(cls, invoice_date='2024-03-01', amount=1000.0, partner=None, salesperson=None):
+        invoice = cls.init_invoice('out_invoice', partner=partner or cls.partner_a,
+                                   invoice_date=invoice_date, amounts=[amount])
+        invoice.invoice_user_id = salesperson or cls.salesperson
+        return invoice
+
+    @classmethod
+    def _create_payment(cls, date='2024-03-10', amount=1000.0, partner=None, currency=None):
+        return cls.env['account.payment'].create({
+            'payment_type': 'inbound',
+            'partner_type': 'customer',
+            'partner_id': (partner or cls.partner_a).id,
+            'amount': amount,
+            'date': date,
+            'journal_id': cls.bank_journal.id,
+            'currency_id': (currency or cls.currency_usd).id,
+        })
+
+    @classmethod
+    def _create_calculation(cls, invoice=None, payment_date='2024-03-10', commission_amount=10.0,
+                            currency=None, salesperson=None, state='calculated', **vals):
+        """Create a calculation with its own draft payment"""
+        currency = currency or cls.currency_usd
+        invoice = invoice or cls._create_invoice(salesperson=salesperson)
+        payment = cls._create_payment(date=payment_date, currency=currency)
+        return cls.env['commission.calculation'].create({
+            'payment_id': payment.id,
+            'invoice_id': invoice.id,
+            'salesperson_id': (salesperson or cls.salesperson).id,
+            'payment_amount': payment.amount,
+            'commission_amount': commission_amount,
+            'currency_id': currency.id,
+            'company_id': cls.company.id,
+            'state': state,
+            **vals,
+        })
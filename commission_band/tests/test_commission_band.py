@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+from psycopg2 import IntegrityError
+
+from odoo import Command
+from odoo.tests import tagged
+from odoo.tools import mute_logger
+
+from .common import CommissionBandCommon
+
+DAYS = [-10000, -9999, -30, -1, 0, 7, 15, 16, 45, 60, 61, 90, 120, 121, 150, 199, 200, 9999, 10000]
+AMOUNTS = [0.0, 50.0, 100.0, 5000.0]
+
+
+@tagged('post_install', '-at_install')
+class TestCommissionBandLookup(CommissionBandCommon):
+
+    def _get_baseline_rate(self, band, days_overdue, payment_amount=0, currency_id=None):
+        """Range lookup of the original get_commission_rate, filtering range_ids"""
+        if band.currency_specific and band.currency_id:
+            if not currency_id or currency_id != band.currency_id.id:
+                return (0.0, 0.0, False)
+        applicable_range = band.range_ids.filtered(
+            lambda r: r.day_from <= days_overdue <= r.day_to and
+            (not r.min_payment_amount or payment_amount >= r.min_payment_amount) and
+            (not r.apply_only_currency_id or r.apply_only_currency_id.id == currency_id)
+        )
+        if applicable_range:
+            range_rec = applicable_range[0]
+            return (range_rec.commission_rate / 100.0, range_rec.indicator_rate / 100.0, range_rec.id)
+        return (0.0, 0.0, False)
+
+    def _assert_lookup_matches_baseline(self, band):
+        for days in DAYS:
+            for amount in AMOUNTS:
+                for currency_id in (None, self.currency_usd.id, self.currency_ves.id):
+                    with self.subTest(days=days, amount=amount, currency_id=currency_id):
+                        self.assertEqual(
+                            band.get_commission_rate(days, amount, currency_id),
+                            self._get_baseline_rate(band, days, amount, currency_id),
+                        )
+
+    def test_lookup_matches_baseline(self):
+        self._assert_lookup_matches_baseline(self.band)
+
+    def test_currency_specific_band_matches_baseline(self):
+        self.band.write({'currency_specific': True, 'currency_id': self.currency_ves.id})
+        self._assert_lookup_matches_baseline(self.band)
+
+    def test_bulk_lookup_matches_single_lookup(self):
+        days = DAYS * len(AMOUNTS)
+        amounts = [amount for amount in AMOUNTS for _days in DAYS]
+        self.assertEqual(
+            self.band.get_commission_rates(days, amounts, self.currency_ves.id),
+            [self.band.get_commission_rate(d, a, self.currency_ves.id) for d, a in zip(days, amounts)],
+        )
+
+    def test_lookup_follows_range_changes(self):
+        self.assertEqual(self.band.get_commission_rate(7)[0], 0.04)
+        on_time = self.band.range_ids.filtered(lambda r: r.name == 'On Time')
+        on_time.commission_rate = 3.0
+        self.assertEqual(self.band.get_commission_rate(7)[0], 0.03)
+        
+        # Shift the boundary between two neighbour ranges in one write
+        late = self.band.range_ids.filtered(lambda r: r.name == 'Late')
+        self.band.write({'range_ids': [
+            Command.update(on_time.id, {'day_to': 20}),
+            Command.update(late.id, {'day_from': 21}),
+        ]})
+        self._assert_lookup_matches_baseline(self.band)
+        self.assertEqual(self.band.get_commission_rate(18)[2], on_time.id)
+
+    @mute_logger('odoo.sql_db')
+    def test_invalid_ranges_rejected(self):
+        for name, day_from, day_to in [('Overlap', 100, 150), ('Inverted', 150, 130)]:
+            with self.subTest(name=name), self.assertRaises(IntegrityError):
+                self.band.write({'range_ids': [
+                    Command.create({'name': name, 'day_from': day_from, 'day_to': day_to, 'commission_rate': 1.0}),
+                ]})
+        
+        # A failed band write leaves the transaction usable and the overlap
+        # constraint checked immediately again
+        with self.assertRaises(IntegrityError), self.env.cr.savepoint():
+            self.env['commission.range'].create({
+                'name': 'Overlap', 'band_id': self.band.id, 'day_from': 100, 'day_to': 150, 'commission_rate': 1.0,
+            })
+            self.env.flush_all()
+        self.assertEqual(len(self.band.range_ids), 5)
+
+
+@tagged('post_install', '-at_install')
+class TestCalculationCounts(CommissionBandCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.other_band = cls.band.copy({'name': 'Other Band', 'code': 'OTHER'})
+        cls.rule = cls.env['commission.rule'].create({
+            'name': 'Band Rule',
+            'code': 'BAND',
+            'company_id': cls.company.id,
+            'commission_type': 'band',
+            'band_id': cls.band.id,
+        })
+
+    def _set_counter(self, enabled):
+        self.env['ir.config_parameter'].set_param('commission_band.calculation_counter', enabled)
+        self.env['commission.calculation']._setup_calculation_counter()
+
+    def _assert_counts(self, band_counts):
+        bands = self.band | self.other_band
+        self.assertEqual(bands.mapped('calculation_count'), band_counts)
+        self.assertEqual(self.rule.calculation_count, self.env['commission.calculation'].search_count([
+            ('rule_id', '=', self.rule.id),
+        ]))
+        self.assertEqual(
+            bands.search([('id', 'in', bands.ids), ('calculation_count', '>', 0)]),
+            bands.filtered(lambda b: b.calculation_count > 0),
+        )
+
+    def _check_counts(self):
+        calculations = self._create_calculation() | self._create_calculation() | self._create_calculation()
+        calculations.write({'rule_id': self.rule.id, 'band_id': self.band.id})
+        self._assert_counts([3, 0])
+        
+        calculations[0].band_id = self.other_band
+        calculations[1].notes = 'Checked'
+        self._assert_counts([2, 1])
+        
+        calculations[1:].unlink()
+        self._assert_counts([0, 1])
+
+    def test_grouped_counts(self):
+        self._set_counter(False)
+        self._check_counts()
+
+    def test_counter_table(self):
+        self._set_counter(True)
+        self._check_counts()
+        
+        self.env['commission.calculation']._cron_fold_calculation_counter()
+        self._assert_counts([0, 1])
+        self.env.cr.execute("SELECT band_id, delta FROM commission_calculation_counter WHERE rule_id = %s",
+                            [self.rule.id])
+        self.assertEqual(self.env.cr.fetchall(), [(self.other_band.id, 1)], "Empty pairs are folded away")
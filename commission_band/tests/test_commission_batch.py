@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import CommissionBandCommon
+
+
+@tagged('post_install', '-at_install')
+class TestCommissionBatchJobs(CommissionBandCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.calculations = cls.env['commission.calculation']
+        for payment_date, salesperson, currency in [
+            ('2024-03-05', cls.salesperson, cls.currency_usd),
+            ('2024-03-10', cls.salesperson, cls.currency_ves),
+            ('2024-03-15', cls.other_salesperson, cls.currency_usd),
+            ('2024-03-20', cls.other_salesperson, cls.currency_usd),
+            ('2024-03-25', cls.salesperson, cls.currency_usd),
+        ]:
+            cls.calculations |= cls._create_calculation(
+                payment_date=payment_date, salesperson=salesperson, currency=currency,
+            )
+        cls.batch = cls.env['commission.batch'].create({
+            'name': 'March 2024',
+            'date_from': '2024-03-01',
+            'date_to': '2024-03-31',
+            'payment_date': '2024-04-10',
+            'company_id': cls.company.id,
+        })
+
+    def _process_jobs(self):
+        self.env['commission.batch']._cron_process_jobs()
+
+    def test_calculate_in_chunks(self):
+        self.batch.action_calculate()
+        self.assertEqual(self.batch.state, 'calculating')
+        self.assertFalse(self.batch.job_date_start, "The job starts when the worker picks it up")
+        
+        self.batch._run_job(2, False)
+        self.assertEqual(self.batch.state, 'calculated')
+        self.assertTrue(self.batch.job_date_start)
+        self.assertEqual((self.batch.job_done, self.batch.job_total), (5, 5))
+        self.assertEqual(self.batch.calculation_ids, self.calculations)
+        self.assertEqual(self.batch.calculation_count, 5)
+        self.assertEqual(self.batch.salesperson_count, 2)
+
+    def test_failure_keeps_transient_state(self):
+        Batch = type(self.env['commission.batch'])
+        
+        def _job_calculate(batch, chunk_size, progress):
+            raise UserError("Rate service unavailable")
+        
+        self.batch.action_calculate()
+        with patch.object(Batch, '_job_calculate', _job_calculate):
+            self._process_jobs()
+        self.assertEqual(self.batch.state, 'calculating')
+        self.assertIn("Rate service unavailable", self.batch.job_error)
+        self.assertFalse(self.batch.calculation_ids)
+        
+        # A failed batch waits for a retry instead of being picked up again
+        self._process_jobs()
+        self.assertEqual(self.batch.state, 'calculating')
+        
+        self.batch.action_retry_job()
+        self.assertFalse(self.batch.job_error)
+        self._process_jobs()
+        self.assertEqual(self.batch.state, 'calculated')
+        self.assertEqual(self.batch.calculation_ids, self.calculations)
+        
+        with self.assertRaises(UserError):
+            self.batch.action_retry_job()
+
+    def test_retry_resumes_partial_work(self):
+        self.batch.action_calculate()
+        self._process_jobs()
+        self.batch.action_review()
+        self.batch.action_generate_payment_document()
+        self._process_jobs()
+        self.assertEqual(self.batch.state, 'payment_generated')
+        
+        # An attempt paid and committed a first chunk, then failed
+        Batch = type(self.env['commission.batch'])
+        
+        def _job_mark_paid(batch, chunk_size, progress):
+            raise UserError("Worker stopped")
+        
+        self.batch.action_mark_paid()
+        with patch.object(Batch, '_job_mark_paid', _job_mark_paid):
+            self._process_jobs()
+        self.assertEqual(self.batch.state, 'paying')
+        self.assertEqual(self.batch.payment_document_id.state, 'draft')
+        self.calculations[:2].action_mark_paid()
+        
+        # The retry only processes what is left
+        self.batch.action_retry_job()
+        self._process_jobs()
+        self.assertEqual(self.batch.state, 'paid')
+        self.assertEqual(self.batch.job_total, 3)
+        self.assertEqual(set(self.calculations.mapped('state')), {'paid'})
+        self.assertEqual(self.batch.payment_document_id.state, 'paid')
+
+    def test_document_paid_through_batch(self):
+        self.batch.action_calculate()
+        self._process_jobs()
+        self.batch.action_review()
+        self.batch.action_generate_payment_document()
+        self._process_jobs()
+        document = self.batch.payment_document_id
+        self.assertEqual(document.line_ids.calculation_ids, self.calculations)
+        self.assertEqual(set(self.calculations.mapped('state')), {'approved'})
+        document.action_confirm()
+        
+        document.action_mark_paid()
+        self.assertEqual(self.batch.state, 'paying')
+        self.assertEqual(document.state, 'confirmed', "The document is paid when the batch job is done")
+        with self.assertRaises(UserError):
+            document.action_mark_paid()
+        with self.assertRaises(UserError):
+            self.calculations[0].action_remove_from_batch()
+        
+        self._process_jobs()
+        self.assertEqual(self.batch.state, 'paid')
+        self.assertEqual(document.state, 'paid')
+
+
+@tagged('post_install', '-at_install')
+class TestCommissionBatchStatistics(CommissionBandCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.currency_eur = cls.env.ref('base.EUR')
+        cls.currency_eur.active = True
+        cls.env['res.currency.rate'].create({
+            'name': '2024-01-01',
+            'rate': 0.9,
+            'currency_id': cls.currency_eur.id,
+            'company_id': cls.company.id,
+        })
+        cls.batches = cls.env['commission.batch'].create([{
+            'name': name,
+            'date_from': date_from,
+            'date_to': date_to,
+            'company_id': cls.company.id,
+        } for name, date_from, date_to in [
+            ('March 2024', '2024-03-01', '2024-03-31'),
+            ('April 2024', '2024-04-01', '2024-04-30'),
+        ]])
+
+    def _get_statistics(self):
+        self.env.flush_all()
+        self.batches.invalidate_recordset()
+        return [
+            (batch.calculation_count, batch.salesperson_count,
+             batch.currency_usd_id.round(batch.total_commission_usd),
+             batch.currency_ves_id.round(batch.total_commission_ves))
+            for batch in self.batches
+        ]
+
+    def _assert_statistics_match_recompute(self):
+        statistics = self._get_statistics()
+        self.batches._recompute_statistics()
+        self.assertEqual(statistics, self._get_statistics())
+
+    def test_deltas_match_recompute(self):
+        march, april = self.batches
+        calculations = self.env['commission.calculation']
+        for payment_date, currency, salesperson, batch in [
+            ('2024-03-05', self.currency_usd, self.salesperson, march),
+            ('2024-03-10', self.currency_ves, self.salesperson, march),
+            ('2024-03-15', self.currency_eur, self.other_salesperson, march),
+            ('2024-03-20', self.currency_usd, self.other_salesperson, march),
+            ('2024-04-02', self.currency_usd, self.salesperson, april),
+        ]:
+            calculations |= self._create_calculation(
+                payment_date=payment_date, currency=currency, salesperson=salesperson,
+                commission_amount=25.0, batch_id=batch.id,
+            )
+        self._assert_statistics_match_recompute()
+        self.assertEqual([stats[:2] for stats in self._get_statistics()], [(4, 2), (1, 1)])
+        
+        # Moves between batches, state, amount, currency and salesperson changes
+        calculations[3].batch_id = april
+        calculations[0].state = 'cancelled'
+        calculations[1].commission_amount = 40.0
+        calculations[2].write({'currency_id': self.currency_usd.id, 'salesperson_id': self.salesperson.id})
+        calculations[4].batch_id = False
+        self._assert_statistics_match_recompute()
+        
+        calculations[0].state = 'calculated'
+        calculations[4].batch_id = march
+        self._assert_statistics_match_recompute()
+        
+        calculations[1:3].unlink()
+        self._assert_statistics_match_recompute()
+        self.assertEqual([stats[:2] for stats in self._get_statistics()], [(2, 1), (1, 1)])
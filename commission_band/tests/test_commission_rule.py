@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from odoo import Command
+from odoo.tests import tagged
+
+from .common import CommissionBandCommon
+
+
+@tagged('post_install', '-at_install')
+class TestCommissionRuleLookup(CommissionBandCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cash_journal = cls.company_data['default_journal_cash']
+        cls.category_b = cls.env['product.category'].create({'name': 'Commission Category B'})
+        cls.product_b.categ_id = cls.category_b
+        cls.team = cls.env['crm.team'].create({
+            'name': 'Commission Team',
+            'company_id': cls.company.id,
+            'member_ids': [Command.link(cls.salesperson.id)],
+        })
+        
+        Rule = cls.env['commission.rule']
+        cls.rules = Rule
+        for priority, name, vals in [
+            (0, 'Archived', {'active': False}),
+            (1, 'Other salesperson', {'salesperson_ids': [Command.link(cls.other_salesperson.id)]}),
+            (2, 'Team and customer', {'team_ids': [Command.link(cls.team.id)],
+                                      'customer_ids': [Command.link(cls.partner_b.id)]}),
+            (3, 'Cash over 500', {'journal_ids': [Command.link(cls.cash_journal.id)], 'min_amount': 500.0}),
+            (4, 'Product B', {'product_ids': [Command.link(cls.product_b.id)]}),
+            (5, 'Category B from March', {'category_ids': [Command.link(cls.category_b.id)],
+                                          'date_from': '2024-03-05'}),
+            (6, 'Until February', {'date_to': '2024-02-28'}),
+            (7, 'Up to 200', {'max_amount': 200.0}),
+            (8, 'Payment term', {'payment_term_ids': [Command.link(cls.pay_terms_a.id)]}),
+        ]:
+            cls.rules |= Rule.create({
+                'name': name,
+                'code': 'RULE%d' % priority,
+                'company_id': cls.company.id,
+                'priority': priority,
+                'commission_type': 'percentage',
+                'percentage_rate': priority + 1.0,
+                **vals,
+            })
+        
+        cls.invoice_a = cls.init_invoice('out_invoice', partner=cls.partner_a, invoice_date='2024-01-15',
+                                         products=[cls.product_a])
+        cls.invoice_a.invoice_payment_term_id = cls.pay_terms_a
+        cls.invoice_b = cls.init_invoice('out_invoice', partner=cls.partner_b, invoice_date='2024-01-15',
+                                         products=[cls.product_b])
+        cls.payments = cls.env['account.payment']
+        for date in ('2024-02-20', '2024-03-10'):
+            for amount in (100.0, 1000.0):
+                for journal in (cls.bank_journal, cls.cash_journal):
+                    payment = cls._create_payment(date=date, amount=amount)
+                    payment.journal_id = journal
+                    cls.payments |= payment
+
+    def _get_baseline_rule(self, company, invoice=None, payment=None, salesperson=None):
+        """Rule search of the original get_applicable_commission_rule"""
+        domain = [('active', '=', True), ('company_id', '=', company.id)]
+        if payment:
+            domain.extend([
+                '|', ('date_from', '=', False), ('date_from', '<=', payment.date),
+                '|', ('date_to', '=', False), ('date_to', '>=', payment.date),
+            ])
+        for rule in self.env['commission.rule'].search(domain, order='priority, sequence'):
+            if rule.matches_criteria(invoice, payment, salesperson):
+                return rule
+        return self.env['commission.rule']
+
+    def _assert_lookup_matches_baseline(self):
+        Rule = self.env['commission.rule']
+        for salesperson in (self.salesperson, self.other_salesperson, None):
+            for invoice in (self.invoice_a, self.invoice_b, None):
+                for payment in (*self.payments, None):
+                    with self.subTest(salesperson=salesperson, invoice=invoice, payment=payment):
+                        self.assertEqual(
+                            Rule._find_applicable_rule(self.company, invoice, payment, salesperson),
+                            self._get_baseline_rule(self.company, invoice, payment, salesperson),
+                        )
+
+    def test_lookup_matches_baseline(self):
+        self._assert_lookup_matches_baseline()
+
+    def test_lookup_follows_rule_changes(self):
+        self.rules.filtered(lambda r: r.priority in (2, 4)).active = False
+        self.rules.filtered(lambda r: r.priority == 0).active = True
+        self.rules.filtered(lambda r: r.priority == 7).write({
+            'max_amount': 0.0,
+            'salesperson_ids': [Command.link(self.salesperson.id)],
+        })
+        self._assert_lookup_matches_baseline()
+
+    def test_salesperson_rule(self):
+        payment = self.payments[0]
+        self.assertEqual(
+            self.salesperson.get_applicable_commission_rule(self.invoice_b, payment),
+            self._get_baseline_rule(self.company, self.invoice_b, payment, self.salesperson),
+        )
+        
+        self.salesperson.commission_band_active = False
+        self.assertFalse(self.salesperson.get_applicable_commission_rule(self.invoice_b, payment))
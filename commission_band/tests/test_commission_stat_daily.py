@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import CommissionBandCommon
+
+
+@tagged('post_install', '-at_install')
+class TestCommissionStatDaily(CommissionBandCommon):
+
+    def _get_rollup(self):
+        """Content of the rollup table, without row IDs"""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT company_id, salesperson_id, date, currency_id, state, band_id,
+                   calculation_count, commission_amount, commission_amount_company,
+                   days_overdue_sum, overdue_count
+              FROM commission_stat_daily
+        """)
+        return sorted(self.env.cr.fetchall(), key=str)
+
+    def _assert_rollup_matches_rebuild(self):
+        rollup = self._get_rollup()
+        self.env['commission.stat.daily']._rebuild()
+        self.assertEqual(rollup, self._get_rollup())
+
+    def _get_stamp(self, salesperson):
+        return self.env['commission.stat.daily']._get_stats_stamp(salesperson.id, self.company.id)
+
+    def test_triggers_match_rebuild(self):
+        invoice = self._create_invoice(invoice_date='2024-03-01')
+        calculations = self.env['commission.calculation']
+        for payment_date, currency, salesperson, state in [
+            ('2024-03-10', self.currency_usd, self.salesperson, 'calculated'),
+            ('2024-03-10', self.currency_usd, self.salesperson, 'validated'),
+            ('2024-03-10', self.currency_ves, self.salesperson, 'validated'),
+            ('2024-03-20', self.currency_usd, self.other_salesperson, 'approved'),
+            ('2024-04-15', self.currency_usd, self.salesperson, 'validated'),
+        ]:
+            calculations |= self._create_calculation(
+                invoice=invoice, payment_date=payment_date, currency=currency,
+                salesperson=salesperson, state=state, commission_amount=25.0,
+            )
+        calculations[:2].band_id = self.band
+        self._assert_rollup_matches_rebuild()
+        
+        # Moves between keys, amount changes and writes of other columns
+        calculations[0].state = 'validated'
+        calculations[1].commission_amount = 40.0
+        calculations[2].payment_id.date = '2024-03-12'
+        calculations[3].salesperson_id = self.salesperson
+        calculations.write({'notes': 'Checked'})
+        self._assert_rollup_matches_rebuild()
+        
+        # Rows left without calculations are deleted
+        calculations[4].unlink()
+        calculations[:2].action_cancel()
+        calculations[:2].unlink()
+        self._assert_rollup_matches_rebuild()
+        self.assertFalse(self.env['commission.stat.daily'].search_count([('calculation_count', '=', 0)]))
+
+    def test_stamp_is_monotonic(self):
+        stamps = [self._get_stamp(self.salesperson)]
+        other_stamp = self._get_stamp(self.other_salesperson)
+        
+        calculation = self._create_calculation()
+        stamps.append(self._get_stamp(self.salesperson))
+        
+        # Writes that do not change the rollup keep the stamp
+        calculation.notes = 'Checked'
+        self.assertEqual(self._get_stamp(self.salesperson), stamps[-1])
+        
+        calculation.commission_amount = 12.0
+        stamps.append(self._get_stamp(self.salesperson))
+        
+        # Deleting the only calculation empties the rollup, but the stamp
+        # still moves forward instead of going back to its initial value
+        calculation.unlink()
+        stamps.append(self._get_stamp(self.salesperson))
+        
+        self.env['commission.stat.daily']._rebuild()
+        stamps.append(self._get_stamp(self.salesperson))
+        
+        self.assertEqual(stamps, sorted(set(stamps)), "Every change must increase the stamp")
+        self.assertEqual(self._get_stamp(self.other_salesperson), other_stamp)
+
+    def test_stamp_not_reused_after_rollback(self):
+        Stat = self.env['commission.stat.daily']
+        calculation = self._create_calculation()
+        stamps = [(self._get_stamp(self.salesperson), Stat._get_dashboard_stamp(self.company))]
+        
+        # Figures cached under the stamps of a rolled back change must never
+        # be served for later data
+        with self.assertRaises(UserError), self.env.cr.savepoint():
+            calculation.commission_amount = 12.0
+            stamps.append((self._get_stamp(self.salesperson), Stat._get_dashboard_stamp(self.company)))
+            raise UserError("Rolled back")
+        self.assertEqual(self._get_stamp(self.salesperson), stamps[0][0])
+        self.assertEqual(Stat._get_dashboard_stamp(self.company), stamps[0][1])
+        
+        calculation.commission_amount = 15.0
+        self.assertNotIn(self._get_stamp(self.salesperson), [stamp for stamp, _dashboard in stamps])
+        self.assertNotIn(Stat._get_dashboard_stamp(self.company), [dashboard for _stamp, dashboard in stamps])
+
+    def test_dashboard_cache_follows_calculations(self):
+        self._create_calculation(state='validated', commission_amount=10.0)
+        data = self.salesperson.get_commission_dashboard_data()
+        
+        self._create_calculation(state='validated', commission_amount=15.0)
+        new_data = self.salesperson.get_commission_dashboard_data()
+        self.assertNotEqual(data, new_data)
+        self.assertEqual(new_data, self.salesperson.get_commission_dashboard_data())
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+from odoo.addons.mail.tests.common import mail_new_test_user
+from odoo.exceptions import UserError
+from odoo.tests import HttpCase, tagged
+
+from .common import CommissionBandCommon
+
+
+@tagged('post_install', '-at_install')
+class TestCommissionDashboardController(CommissionBandCommon, HttpCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.manager = mail_new_test_user(
+            cls.env,
+            login='commission_dashboard_manager',
+            groups='base.group_user,commission_band.group_commission_band_manager',
+            company_id=cls.company.id,
+        )
+        cls.url = '/commission_band/dashboard?company_id=%s' % cls.company.id
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.manager.login, self.manager.login)
+
+    def _get_dashboard(self, etag=None):
+        self.env.flush_all()
+        return self.url_open(self.url, headers={'If-None-Match': etag} if etag else None)
+
+    def test_etag_revalidation(self):
+        self._create_calculation(state='validated', commission_amount=10.0)
+        response = self._get_dashboard()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['totals']['count'], 1)
+        etag = response.headers['ETag']
+        
+        # Unchanged statistics: nothing is recomputed
+        response = self._get_dashboard(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        
+        # Any calculation change gives a new ETag, even one deleting rows
+        calculation = self._create_calculation(state='validated', commission_amount=15.0)
+        response = self._get_dashboard(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['totals']['count'], 2)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        
+        calculation.unlink()
+        response = self._get_dashboard(response.headers['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['totals']['count'], 1)
+        self.assertNotEqual(response.headers['ETag'], etag, "The ETag must not come back to an earlier value")
+
+    def test_etag_after_rollback(self):
+        calculation = self._create_calculation(state='validated', commission_amount=10.0)
+        etag = self._get_dashboard().headers['ETag']
+        
+        # An ETag served while a change was in progress, which was then
+        # rolled back, must not validate the figures of a later change
+        with self.assertRaises(UserError), self.env.cr.savepoint():
+            calculation.commission_amount = 12.0
+            rolled_back_etag = self._get_dashboard().headers['ETag']
+            raise UserError("Rolled back")
+        self.assertNotEqual(rolled_back_etag, etag)
+        self.assertEqual(self._get_dashboard(etag).status_code, 304)
+        
+        calculation.commission_amount = 15.0
+        response = self._get_dashboard(rolled_back_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['totals']['amount'], 15.0)
+        self.assertNotIn(response.headers['ETag'], (etag, rolled_back_etag))
+
+    def test_disallowed_company(self):
+        other_company = self.env['res.company'].create({'name': 'Other Commission Company'})
+        response = self.url_open('/commission_band/dashboard?company_id=%s' % other_company.id)
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import importlib.util
+
+from odoo.tests import tagged
+from odoo.tools import sql
+from odoo.tools.misc import file_path
+
+from .common import CommissionBandCommon
+
+
+def _load_migration(version, name):
+    path = file_path('commission_band/migrations/%s/%s.py' % (version, name))
+    spec = importlib.util.spec_from_file_location('commission_band_%s_%s' % (version, name), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@tagged('post_install', '-at_install')
+class TestMigrations(CommissionBandCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pre_migrate = _load_migration('18.0.1.1.0', 'pre-migrate')
+        cls.post_migrate = _load_migration('18.0.1.1.0', 'post-migrate')
+        cls.calculations = cls._create_calculation() | cls._create_calculation() | cls._create_calculation()
+        batch = cls.env['commission.batch'].create({
+            'name': 'March 2024',
+            'date_from': '2024-03-01',
+            'date_to': '2024-03-31',
+            'company_id': cls.company.id,
+        })
+        document = cls.env['commission.payment.document'].create({
+            'batch_id': batch.id,
+            'payment_date': '2024-04-10',
+            'company_id': cls.company.id,
+        })
+        cls.lines = cls.env['commission.payment.line'].create([
+            {'document_id': document.id, 'salesperson_id': cls.salesperson.id},
+            {'document_id': document.id, 'salesperson_id': cls.salesperson.id},
+        ])
+        cls.env.flush_all()
+
+    def _create_relation_table(self, rows):
+        """Restore the Many2many table of calculation_ids as it was before 18.0.1.1.0"""
+        self.env.cr.execute("""
+            CREATE TABLE commission_payment_line_calc_rel (
+                line_id integer NOT NULL,
+                calc_id integer NOT NULL,
+                PRIMARY KEY (line_id, calc_id)
+            )
+        """)
+        for line, calculation in rows:
+            self.env.cr.execute(
+                "INSERT INTO commission_payment_line_calc_rel (line_id, calc_id) VALUES (%s, %s)",
+                [line.id, calculation.id],
+            )
+
+    def _get_payment_lines(self):
+        self.env.cr.execute("""
+            SELECT id, payment_line_id
+              FROM commission_calculation
+             WHERE id = ANY(%s)
+        """, [self.calculations.ids])
+        return dict(self.env.cr.fetchall())
+
+    def test_pre_migrate_copies_relation(self):
+        line_1, line_2 = self.lines
+        calc_1, calc_2, calc_3 = self.calculations
+        self._create_relation_table([(line_1, calc_1), (line_2, calc_1), (line_1, calc_2)])
+        
+        self.pre_migrate.migrate(self.env.cr, '18.0.1.0.0')
+        self.assertEqual(self._get_payment_lines(), {
+            calc_1.id: line_2.id,  # the latest line wins
+            calc_2.id: line_1.id,
+            calc_3.id: None,
+        })
+
+    def test_pre_migrate_without_relation(self):
+        # Fresh installs and databases already migrated are left alone
+        self.pre_migrate.migrate(self.env.cr, None)
+        self.pre_migrate.migrate(self.env.cr, '18.0.1.0.0')
+        self.assertEqual(set(self._get_payment_lines().values()), {None})
+        
+        self._create_relation_table([(self.lines[0], self.calculations[0])])
+        self.pre_migrate.migrate(self.env.cr, None)
+        self.assertEqual(set(self._get_payment_lines().values()), {None})
+
+    def test_post_migrate_drops_relation(self):
+        line_1, line_2 = self.lines
+        calc_1, calc_2, _calc_3 = self.calculations
+        self._create_relation_table([(line_1, calc_1), (line_2, calc_2)])
+        
+        # Not copied yet: the links are kept
+        self.post_migrate.migrate(self.env.cr, '18.0.1.0.0')
+        self.assertTrue(sql.table_exists(self.env.cr, 'commission_payment_line_calc_rel'))
+        
+        self.pre_migrate.migrate(self.env.cr, '18.0.1.0.0')
+        self.post_migrate.migrate(self.env.cr, '18.0.1.0.0')
+        self.assertFalse(sql.table_exists(self.env.cr, 'commission_payment_line_calc_rel'))
+        self.assertEqual(self._get_payment_lines()[calc_2.id], line_2.id)
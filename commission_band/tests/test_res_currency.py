@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import CommissionBandCommon
+
+DATES = ['1990-01-01', '2024-02-15', '2024-03-01', '2024-03-10', '2024-03-20', '2024-05-01']
+
+
+@tagged('post_install', '-at_install')
+class TestCommissionRateTable(CommissionBandCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.currency_eur = cls.env.ref('base.EUR')
+        cls.currency_eur.active = True
+        cls.other_company = cls.env['res.company'].create({'name': 'Other Commission Company'})
+        cls.env['res.currency.rate'].create([
+            # Shared rates, with a company-specific rate in between
+            {'name': '2024-02-01', 'rate': 0.90, 'currency_id': cls.currency_eur.id, 'company_id': False},
+            {'name': '2024-03-01', 'rate': 0.95, 'currency_id': cls.currency_eur.id, 'company_id': cls.company.id},
+            {'name': '2024-04-01', 'rate': 0.92, 'currency_id': cls.currency_eur.id, 'company_id': False},
+            {'name': '2024-03-15', 'rate': 38.0, 'currency_id': cls.currency_ves.id, 'company_id': cls.company.id},
+        ])
+
+    def test_convert_matches_odoo(self):
+        currencies = self.currency_usd | self.currency_eur | self.currency_ves
+        companies = self.company | self.other_company
+        dates = [fields.Date.to_date(date) for date in DATES]
+        for date_from in (None, dates[0]):
+            table = self.env['res.currency']._get_commission_rate_table(currencies.ids, companies, date_from)
+            for company in companies:
+                for date in dates:
+                    for from_currency in currencies:
+                        for to_currency in currencies - from_currency:
+                            with self.subTest(company=company.name, date=date, date_from=date_from,
+                                              from_currency=from_currency.name, to_currency=to_currency.name):
+                                self.assertEqual(
+                                    table.convert(1000.0, from_currency.id, to_currency.id, company.id, date),
+                                    from_currency._convert(1000.0, to_currency, company, date),
+                                )
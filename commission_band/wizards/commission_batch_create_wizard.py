@@ -116,16 +116,15 @@ class CommissionBatchCreateWizard(models.TransientModel):
                 
                 domain.append(('state', 'in', states))
                 
-                calculations = self.env['commission.calculation'].search(domain)
+                # Aggregate in a single query (the daily rollup has no batch
+                # dimension, so the calculations are grouped directly)
+                [(count, salesperson_count, total)] = self.env['commission.calculation']._read_group(
+                    domain, [], ['__count', 'salesperson_id:count_distinct', 'commission_amount_company:sum']
+                )
                 
-                wizard.calculation_count = len(calculations)
-                wizard.salesperson_count = len(calculations.mapped('salesperson_id'))
-                
-                # Calculate total in company currency
-                total = 0.0
-                for calc in calculations:
-                    total += calc.commission_amount_company
-                wizard.total_amount = total
+                wizard.calculation_count = count
+                wizard.salesperson_count = salesperson_count
+                wizard.total_amount = total or 0.0
             else:
                 wizard.calculation_count = 0
                 wizard.salesperson_count = 0